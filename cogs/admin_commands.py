@@ -2,14 +2,24 @@
 import discord
 from discord import app_commands
 from discord.ext import commands
-import json
-import os
+import asyncio
+import time
+from datetime import datetime
+import pytz
+from utils.race_monitor import refresh_race, format_time
+from utils.state_store import get_store
+from utils.team_cache import get_team_cache
 
 PURPLE = 0x9B59B6
 
+# Seconds before the same race can be refreshed again
+REFRESH_COOLDOWN = 120
+
 class AdminCommands(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.refreshing = {}  # (guild_id, race_id) -> refresh task in progress
+        self.last_refresh = {}  # (guild_id, race_id) -> when its last refresh finished
 
     @app_commands.command(name="setup-dungeon-race", description="Setup dungeon race channels and category")
     @app_commands.checks.has_permissions(administrator=True)
@@ -92,33 +102,30 @@ class AdminCommands(commands.Cog):
     @app_commands.command(name="reset-teams", description="Clear all teams for this server")
     @app_commands.checks.has_permissions(administrator=True)
     async def reset_teams(self, interaction: discord.Interaction):
-        teams_file = f'./Teams/{interaction.guild.id}.json'
+        # Load teams to delete their channels
+        await get_team_cache().load(interaction.guild.id)
+        teams_data = get_team_cache().load_teams(interaction.guild.id)
         
-        if not os.path.exists(teams_file):
+        if not teams_data:
             await interaction.response.send_message("No teams to reset!", ephemeral=True)
             return
         
-        # Load teams to delete their channels
-        with open(teams_file, 'r') as f:
-            teams_data = json.load(f)
-        
         await interaction.response.defer(ephemeral=True)
         
         # Delete team channels
         for team_name, team_data in teams_data.items():
-            if 'text_channel_id' in team_data:
+            if team_data.get('text_channel_id'):
                 text_channel = interaction.guild.get_channel(team_data['text_channel_id'])
                 if text_channel:
                     await text_channel.delete()
             
-            if 'voice_channel_id' in team_data:
+            if team_data.get('voice_channel_id'):
                 voice_channel = interaction.guild.get_channel(team_data['voice_channel_id'])
                 if voice_channel:
                     await voice_channel.delete()
         
-        # Clear the teams file
-        with open(teams_file, 'w') as f:
-            json.dump({}, f, indent=2)
+        # Clear the guild's teams
+        get_team_cache().delete_teams(interaction.guild.id)
         
         # Clear team messages
         teams_channel = discord.utils.get(interaction.guild.text_channels, name='teams')
@@ -129,14 +136,7 @@ class AdminCommands(commands.Cog):
     @app_commands.command(name="cancel-race-event", description="Cancel an active race event")
     @app_commands.checks.has_permissions(administrator=True)
     async def cancel_race_event(self, interaction: discord.Interaction):
-        events_file = f'./RaceEvents/{interaction.guild.id}.json'
-        
-        if not os.path.exists(events_file):
-            await interaction.response.send_message("❌ No race events found!", ephemeral=True)
-            return
-        
-        with open(events_file, 'r') as f:
-            events = json.load(f)
+        events = await get_store().load_events(interaction.guild.id)
         
         if not events:
             await interaction.response.send_message("❌ No race events to cancel!", ephemeral=True)
@@ -160,34 +160,23 @@ class AdminCommands(commands.Cog):
             await select_interaction.response.defer(ephemeral=True)
             
             # Load teams associated with this race
-            teams_file = f'./Teams/{interaction.guild.id}.json'
-            if os.path.exists(teams_file):
-                with open(teams_file, 'r') as f:
-                    teams = json.load(f)
-                
-                # Delete teams and their channels for this race
-                teams_to_delete = []
-                for team_name, team_data in teams.items():
-                    if team_data.get('race_id') == selected_race:
-                        teams_to_delete.append(team_name)
-                        
-                        # Delete team channels
-                        if 'text_channel_id' in team_data:
-                            text_channel = interaction.guild.get_channel(team_data['text_channel_id'])
-                            if text_channel:
-                                await text_channel.delete()
-                        
-                        if 'voice_channel_id' in team_data:
-                            voice_channel = interaction.guild.get_channel(team_data['voice_channel_id'])
-                            if voice_channel:
-                                await voice_channel.delete()
-                
-                # Remove teams from file
-                for team_name in teams_to_delete:
-                    del teams[team_name]
+            await get_team_cache().load(interaction.guild.id)
+            teams = get_team_cache().load_teams(interaction.guild.id, selected_race)
+            
+            # Delete teams and their channels for this race
+            for team_name, team_data in teams.items():
+                # Delete team channels
+                if team_data.get('text_channel_id'):
+                    text_channel = interaction.guild.get_channel(team_data['text_channel_id'])
+                    if text_channel:
+                        await text_channel.delete()
                 
-                with open(teams_file, 'w') as f:
-                    json.dump(teams, f, indent=2)
+                if team_data.get('voice_channel_id'):
+                    voice_channel = interaction.guild.get_channel(team_data['voice_channel_id'])
+                    if voice_channel:
+                        await voice_channel.delete()
+            
+            get_team_cache().delete_teams(interaction.guild.id, selected_race)
             
             # Delete Discord scheduled event
             for event in interaction.guild.scheduled_events:
@@ -197,10 +186,12 @@ class AdminCommands(commands.Cog):
                     except:
                         pass
             
-            # Remove race from events file
-            del events[selected_race]
-            with open(events_file, 'w') as f:
-                json.dump(events, f, indent=2)
+            # Remove race from the race events
+            await get_store().delete_race(interaction.guild.id, selected_race)
+            
+            race_timers = getattr(self.bot, 'race_timers', None)
+            if race_timers:
+                race_timers.cancel_race(interaction.guild.id, selected_race)
             
             # Delete any leaderboard messages
             leaderboard_channel = discord.utils.get(interaction.guild.text_channels, name='leaderboard')
@@ -231,5 +222,97 @@ class AdminCommands(commands.Cog):
         
         await interaction.response.send_message("Select a race event to cancel:", view=view, ephemeral=True)
 
+    @app_commands.command(name="refresh-race", description="Check a race for new completions right now")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def refresh_race_command(self, interaction: discord.Interaction):
+        events = await get_store().load_events(interaction.guild.id)
+        
+        now = datetime.now(pytz.UTC)
+        active_races = [
+            race_id for race_id, race_data in events.items()
+            if datetime.fromisoformat(race_data['start_date']) <= now <= datetime.fromisoformat(race_data['end_date'])
+        ]
+        
+        if not active_races:
+            await interaction.response.send_message("❌ No active races to refresh!", ephemeral=True)
+            return
+        
+        # Create dropdown for race selection
+        options = [
+            discord.SelectOption(label=race_id, value=race_id)
+            for race_id in active_races
+        ]
+        
+        select = discord.ui.Select(
+            placeholder="Select a race to refresh",
+            options=options,
+            custom_id="refresh_race_select"
+        )
+        
+        async def select_callback(select_interaction: discord.Interaction):
+            selected_race = select_interaction.data['values'][0]
+            key = (interaction.guild.id, selected_race)
+            
+            # Join a refresh that's already running, otherwise respect the cooldown
+            task = self.refreshing.get(key)
+            if task is None:
+                since_last = time.monotonic() - self.last_refresh.get(key, 0)
+                if since_last < REFRESH_COOLDOWN:
+                    await select_interaction.response.send_message(
+                        f"⏳ **{selected_race}** was just refreshed. Try again in {int(REFRESH_COOLDOWN - since_last)}s.",
+                        ephemeral=True
+                    )
+                    return
+                
+                task = asyncio.create_task(self._refresh(interaction.guild, selected_race))
+                self.refreshing[key] = task
+            
+            await select_interaction.response.defer(ephemeral=True, thinking=True)
+            
+            try:
+                summary = await asyncio.shield(task)
+            except Exception as e:
+                await select_interaction.followup.send(f"❌ Could not refresh **{selected_race}**: {e}", ephemeral=True)
+                return
+            
+            await select_interaction.followup.send(embed=self._refresh_embed(selected_race, summary), ephemeral=True)
+        
+        select.callback = select_callback
+        view = discord.ui.View()
+        view.add_item(select)
+        
+        await interaction.response.send_message("Select a race to refresh:", view=view, ephemeral=True)
+    
+    async def _refresh(self, guild, race_id):
+        """Run the check (in a monitor worker if there are any) and start the cooldown"""
+        key = (guild.id, race_id)
+        try:
+            monitor_workers = getattr(self.bot, 'monitor_workers', None)
+            if monitor_workers:
+                return await monitor_workers.refresh_race(guild.id, race_id)
+            return await refresh_race(self.bot, guild, race_id)
+        finally:
+            self.refreshing.pop(key, None)
+            self.last_refresh[key] = time.monotonic()
+    
+    def _refresh_embed(self, race_id, summary):
+        """New valid and invalid runs per team"""
+        embed = discord.Embed(
+            title=f"🔄 {race_id} - Refreshed",
+            color=PURPLE
+        )
+        
+        if not summary:
+            embed.description = "No new completions since the last check."
+            return embed
+        
+        # Discord allows 25 fields per embed
+        for team_name, changes in list(summary.items())[:25]:
+            lines = [f"✅ {format_time(seconds)}" for _, seconds in changes['valid']]
+            lines += [f"❌ {reason}" for _, reason in changes['invalid']]
+            embed.add_field(name=team_name, value="\n".join(lines)[:1024], inline=False)
+        
+        return embed
+
 async def setup(bot):
     await bot.add_cog(AdminCommands(bot))
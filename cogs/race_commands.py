@@ -3,9 +3,9 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 import json
-import os
 from datetime import datetime
 import pytz
+from utils.state_store import get_store
 
 PURPLE = 0x9B59B6
 
@@ -148,21 +148,17 @@ class RaceModal(discord.ui.Modal, title="Create Race Event"):
         race_id = self.race_name.value
         
         # Save race event
-        events_file = f'./RaceEvents/{interaction.guild.id}.json'
-        events = {}
-        if os.path.exists(events_file):
-            with open(events_file, 'r') as f:
-                events = json.load(f)
+        store = get_store()
         
         # Check if race already exists
-        if race_id in events:
+        if race_id in await store.load_events(interaction.guild.id):
             await interaction.response.send_message(
                 "❌ A race with this name already exists!",
                 ephemeral=True
             )
             return
         
-        events[race_id] = {
+        race_data = {
             'dungeon_name': self.dungeon['name'],
             'dungeon_hash': self.dungeon['hash'],
             'start_date': start_dt.isoformat(),
@@ -171,8 +167,12 @@ class RaceModal(discord.ui.Modal, title="Create Race Event"):
             'race_type': race_type
         }
         
-        with open(events_file, 'w') as f:
-            json.dump(events, f, indent=2)
+        await store.put_race(interaction.guild.id, race_id, race_data)
+        
+        # Start/end timers so the race is finalized right at its end time
+        race_timers = getattr(interaction.client, 'race_timers', None)
+        if race_timers:
+            race_timers.schedule_race(interaction.guild.id, race_id, race_data)
         
         # Create Discord event
         rules_channel = discord.utils.get(interaction.guild.text_channels, name='dungeon-race-rules')
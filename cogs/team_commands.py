@@ -2,8 +2,8 @@
 import discord
 from discord import app_commands
 from discord.ext import commands
-import json
-import os
+from utils.state_store import get_store
+from utils.team_cache import get_team_cache, TeamError, MAX_TEAM_MEMBERS
 
 PURPLE = 0x9B59B6
 
@@ -14,16 +14,7 @@ class TeamCommands(commands.Cog):
     @app_commands.command(name="create-team", description="Create a team for a race")
     async def create_team(self, interaction: discord.Interaction):
         # Load race events
-        events_file = f'./RaceEvents/{interaction.guild.id}.json'
-        if not os.path.exists(events_file):
-            await interaction.response.send_message(
-                "❌ No active race events! An admin must create one first.",
-                ephemeral=True
-            )
-            return
-        
-        with open(events_file, 'r') as f:
-            events = json.load(f)
+        events = await get_store().load_events(interaction.guild.id)
         
         if not events:
             await interaction.response.send_message(
@@ -86,12 +77,8 @@ class TeamModal(discord.ui.Modal, title="Create Team"):
         self.add_item(self.member3)
     
     async def on_submit(self, interaction: discord.Interaction):
-        # Load teams
-        teams_file = f'./Teams/{interaction.guild.id}.json'
-        teams = {}
-        if os.path.exists(teams_file):
-            with open(teams_file, 'r') as f:
-                teams = json.load(f)
+        teams = get_team_cache()
+        await teams.load(interaction.guild.id)
         
         # Collect all team members
         members = [self.captain.display_name]
@@ -101,22 +88,18 @@ class TeamModal(discord.ui.Modal, title="Create Team"):
             members.append(self.member3.value)
         
         # Check for duplicate players across all teams
-        for existing_team_name, existing_team_data in teams.items():
-            if existing_team_data.get('race_id') != self.race_id:
-                continue
-            
-            existing_members = existing_team_data.get('members', [])
-            for member in members:
-                if member in existing_members:
-                    await interaction.response.send_message(
-                        f"❌ Error: {member} is already on team '{existing_team_name}'. "
-                        "Players can only be on one team per race. Try again!",
-                        ephemeral=True
-                    )
-                    return
+        for member in members:
+            existing_team_name = teams.find_member_team(interaction.guild.id, self.race_id, member)
+            if existing_team_name:
+                await interaction.response.send_message(
+                    f"❌ Error: {member} is already on team '{existing_team_name}'. "
+                    "Players can only be on one team per race. Try again!",
+                    ephemeral=True
+                )
+                return
         
         # Check if team name already exists
-        if self.team_name.value in teams:
+        if teams.get_team(interaction.guild.id, self.team_name.value):
             await interaction.response.send_message(
                 f"❌ A team named '{self.team_name.value}' already exists!",
                 ephemeral=True
@@ -125,6 +108,44 @@ class TeamModal(discord.ui.Modal, title="Create Team"):
         
         await interaction.response.defer(ephemeral=True)
         
+        # Claim the name and players now, before the slow channel setup (checked again - someone
+        # may have taken them since the checks above)
+        try:
+            teams.create_team(interaction.guild.id, self.team_name.value, {
+                'race_id': self.race_id,
+                'captain': self.captain.display_name,
+                'captain_id': self.captain.id,
+                'members': members
+            })
+        except TeamError as e:
+            await interaction.followup.send(f"❌ {e}", ephemeral=True)
+            return
+        
+        try:
+            text_channel, voice_channel, message = await self.create_team_channels(interaction, members)
+        except Exception:
+            # Give the name and players back
+            teams.delete_team(interaction.guild.id, self.team_name.value)
+            raise
+        
+        # Save team data
+        def add_channels(team_data):
+            team_data.update({
+                'text_channel_id': text_channel.id,
+                'voice_channel_id': voice_channel.id,
+                'message_id': message.id
+            })
+            return team_data
+        
+        teams.update_team(interaction.guild.id, self.team_name.value, add_channels)
+        
+        await interaction.followup.send(
+            f"✅ Team '{self.team_name.value}' created! Check {text_channel.mention}",
+            ephemeral=True
+        )
+    
+    async def create_team_channels(self, interaction, members):
+        """Create the team's text and voice channels and its message in #teams"""
         # Create team channels
         guild = interaction.guild
         category = discord.utils.get(guild.categories, name="Dungeon Race")
@@ -169,24 +190,7 @@ class TeamModal(discord.ui.Modal, title="Create Team"):
         view = TeamView(self.team_name.value, interaction.guild.id)
         message = await teams_channel.send(embed=embed, view=view)
         
-        # Save team data
-        teams[self.team_name.value] = {
-            'race_id': self.race_id,
-            'captain': self.captain.display_name,
-            'captain_id': self.captain.id,
-            'members': members,
-            'text_channel_id': text_channel.id,
-            'voice_channel_id': voice_channel.id,
-            'message_id': message.id
-        }
-        
-        with open(teams_file, 'w') as f:
-            json.dump(teams, f, indent=2)
-        
-        await interaction.followup.send(
-            f"✅ Team '{self.team_name.value}' created! Check {text_channel.mention}",
-            ephemeral=True
-        )
+        return text_channel, voice_channel, message
 
 class TeamView(discord.ui.View):
     def __init__(self, team_name, guild_id):
@@ -235,44 +239,33 @@ class TeamView(discord.ui.View):
             # DEFER IMMEDIATELY - interactions must be responded to within 3 seconds
             await interaction.response.defer(ephemeral=True)
             
-            teams_file = f'./Teams/{interaction.guild.id}.json'
+            teams = get_team_cache()
+            await teams.load(interaction.guild.id)
+            user_name = interaction.user.display_name
             
-            if not os.path.exists(teams_file):
-                await interaction.followup.send("❌ Teams file not found!", ephemeral=True)
-                return
+            def join(team_data):
+                # Check if team is full
+                if len(team_data['members']) >= MAX_TEAM_MEMBERS:
+                    raise TeamError(f"Team is full (max {MAX_TEAM_MEMBERS} players)!")
                 
-            with open(teams_file, 'r') as f:
-                teams = json.load(f)
-            
-            team_data = teams.get(self.team_name)
-            if not team_data:
-                await interaction.followup.send("❌ Team not found!", ephemeral=True)
-                return
-            
-            # Check if team is full
-            if len(team_data['members']) >= 3:
-                await interaction.followup.send("❌ Team is full (max 3 players)!", ephemeral=True)
-                return
+                # Check if user is already on this team, or on another team for this race
+                other_team_name = teams.find_member_team(interaction.guild.id, team_data['race_id'], user_name)
+                if other_team_name == self.team_name:
+                    raise TeamError("You're already on this team!")
+                if other_team_name:
+                    raise TeamError(f"You're already on team '{other_team_name}' for this race!")
+                
+                team_data['members'].append(user_name)
+                return team_data
             
-            # Check if user is already on this team
-            user_name = interaction.user.display_name
-            if user_name in team_data['members']:
-                await interaction.followup.send("❌ You're already on this team!", ephemeral=True)
+            # Add user to team FIRST (saved before the permission calls, so players clicking
+            # Join at the same time can't overwrite each other or overfill the team)
+            try:
+                team_data = teams.update_team(interaction.guild.id, self.team_name, join)
+            except TeamError as e:
+                await interaction.followup.send(f"❌ {e}", ephemeral=True)
                 return
             
-            # Check if user is on another team for this race
-            race_id = team_data['race_id']
-            for other_team_name, other_team_data in teams.items():
-                if other_team_data.get('race_id') == race_id and user_name in other_team_data.get('members', []):
-                    await interaction.followup.send(
-                        f"❌ You're already on team '{other_team_name}' for this race!",
-                        ephemeral=True
-                    )
-                    return
-            
-            # Add user to team FIRST (before trying to set permissions)
-            team_data['members'].append(user_name)
-            
             # Update channel permissions (with better error handling)
             text_channel = interaction.guild.get_channel(team_data.get('text_channel_id'))
             voice_channel = interaction.guild.get_channel(team_data.get('voice_channel_id'))
@@ -306,12 +299,8 @@ class TeamView(discord.ui.View):
                 except Exception as e:
                     print(f"✗ Error setting voice channel permissions: {e}")
             
-            # Save and update message
-            teams[self.team_name] = team_data
-            with open(teams_file, 'w') as f:
-                json.dump(teams, f, indent=2)
-            
-            # Update embed
+            # Update embed (with whoever else joined meanwhile)
+            team_data = teams.get_team(interaction.guild.id, self.team_name) or team_data
             captain = interaction.guild.get_member(team_data['captain_id'])
             embed = discord.Embed(
                 title=f"🏁 {self.team_name}",
@@ -344,31 +333,55 @@ class TeamView(discord.ui.View):
             # DEFER IMMEDIATELY
             await interaction.response.defer(ephemeral=True)
             
-            teams_file = f'./Teams/{interaction.guild.id}.json'
+            teams = get_team_cache()
+            await teams.load(interaction.guild.id)
+            user_name = interaction.user.display_name
             
-            if not os.path.exists(teams_file):
-                await interaction.followup.send("❌ Teams file not found!", ephemeral=True)
-                return
+            def leave(team_data):
+                if user_name not in team_data['members']:
+                    raise TeamError("You're not on this team!")
                 
-            with open(teams_file, 'r') as f:
-                teams = json.load(f)
-            
-            team_data = teams.get(self.team_name)
-            if not team_data:
-                await interaction.followup.send("❌ Team not found!", ephemeral=True)
-                return
+                # Remove user from team
+                team_data['members'].remove(user_name)
+                
+                # If captain left, promote next member or delete team
+                if interaction.user.id == team_data['captain_id']:
+                    if not team_data['members']:
+                        return None  # Delete team if empty
+                    
+                    # Find new captain
+                    new_captain_name = team_data['members'][0]
+                    new_captain = discord.utils.get(interaction.guild.members, display_name=new_captain_name)
+                    if new_captain:
+                        team_data['captain'] = new_captain.display_name
+                        team_data['captain_id'] = new_captain.id
+                
+                return team_data
             
-            user_name = interaction.user.display_name
-            if user_name not in team_data['members']:
-                await interaction.followup.send("❌ You're not on this team!", ephemeral=True)
+            # Save the change before the Discord calls (the channels are looked up from the team as it was)
+            previous = teams.get_team(interaction.guild.id, self.team_name)
+            try:
+                team_data = teams.update_team(interaction.guild.id, self.team_name, leave)
+            except TeamError as e:
+                await interaction.followup.send(f"❌ {e}", ephemeral=True)
                 return
             
-            # Remove user from team
-            team_data['members'].remove(user_name)
-            
             # Remove channel permissions
-            text_channel = interaction.guild.get_channel(team_data.get('text_channel_id'))
-            voice_channel = interaction.guild.get_channel(team_data.get('voice_channel_id'))
+            text_channel = interaction.guild.get_channel(previous.get('text_channel_id'))
+            voice_channel = interaction.guild.get_channel(previous.get('voice_channel_id'))
+            
+            if team_data is None:
+                try:
+                    if text_channel:
+                        await text_channel.delete()
+                    if voice_channel:
+                        await voice_channel.delete()
+                    await interaction.message.delete()
+                except Exception as e:
+                    print(f"✗ Error deleting channels: {e}")
+                
+                await interaction.followup.send("✅ Left team! Team deleted (was empty).", ephemeral=True)
+                return
             
             if text_channel:
                 try:
@@ -382,38 +395,8 @@ class TeamView(discord.ui.View):
                 except Exception as e:
                     print(f"✗ Error removing voice channel permissions: {e}")
             
-            # If captain left, promote next member or delete team
-            if interaction.user.id == team_data['captain_id']:
-                if len(team_data['members']) > 0:
-                    # Find new captain
-                    new_captain_name = team_data['members'][0]
-                    new_captain = discord.utils.get(interaction.guild.members, display_name=new_captain_name)
-                    if new_captain:
-                        team_data['captain'] = new_captain.display_name
-                        team_data['captain_id'] = new_captain.id
-                else:
-                    # Delete team if empty
-                    try:
-                        if text_channel:
-                            await text_channel.delete()
-                        if voice_channel:
-                            await voice_channel.delete()
-                        await interaction.message.delete()
-                    except Exception as e:
-                        print(f"✗ Error deleting channels: {e}")
-                        
-                    del teams[self.team_name]
-                    with open(teams_file, 'w') as f:
-                        json.dump(teams, f, indent=2)
-                    await interaction.followup.send("✅ Left team! Team deleted (was empty).", ephemeral=True)
-                    return
-            
-            # Save and update
-            teams[self.team_name] = team_data
-            with open(teams_file, 'w') as f:
-                json.dump(teams, f, indent=2)
-            
-            # Update embed
+            # Update embed (with any other changes made meanwhile)
+            team_data = teams.get_team(interaction.guild.id, self.team_name) or team_data
             captain = interaction.guild.get_member(team_data['captain_id'])
             embed = discord.Embed(
                 title=f"🏁 {self.team_name}",
@@ -439,16 +422,8 @@ class TeamView(discord.ui.View):
                 pass
     
     async def handle_edit(self, interaction: discord.Interaction):
-        teams_file = f'./Teams/{interaction.guild.id}.json'
-        
-        if not os.path.exists(teams_file):
-            await interaction.response.send_message("❌ Teams file not found!", ephemeral=True)
-            return
-            
-        with open(teams_file, 'r') as f:
-            teams = json.load(f)
-        
-        team_data = teams.get(self.team_name)
+        await get_team_cache().load(interaction.guild.id)
+        team_data = get_team_cache().get_team(interaction.guild.id, self.team_name)
         if not team_data:
             await interaction.response.send_message("❌ Team not found!", ephemeral=True)
             return
@@ -462,16 +437,8 @@ class TeamView(discord.ui.View):
         await interaction.response.send_modal(modal)
     
     async def handle_delete(self, interaction: discord.Interaction):
-        teams_file = f'./Teams/{interaction.guild.id}.json'
-        
-        if not os.path.exists(teams_file):
-            await interaction.response.send_message("❌ Teams file not found!", ephemeral=True)
-            return
-            
-        with open(teams_file, 'r') as f:
-            teams = json.load(f)
-        
-        team_data = teams.get(self.team_name)
+        await get_team_cache().load(interaction.guild.id)
+        team_data = get_team_cache().get_team(interaction.guild.id, self.team_name)
         if not team_data:
             await interaction.response.send_message("❌ Team not found!", ephemeral=True)
             return
@@ -481,20 +448,18 @@ class TeamView(discord.ui.View):
             await interaction.response.send_message("❌ Only the team captain can delete the team!", ephemeral=True)
             return
         
+        # Delete team (before the channels, so nobody can join it meanwhile)
+        get_team_cache().delete_team(interaction.guild.id, self.team_name)
+        
         # Delete channels
-        text_channel = interaction.guild.get_channel(team_data['text_channel_id'])
-        voice_channel = interaction.guild.get_channel(team_data['voice_channel_id'])
+        text_channel = interaction.guild.get_channel(team_data.get('text_channel_id'))
+        voice_channel = interaction.guild.get_channel(team_data.get('voice_channel_id'))
         
         if text_channel:
             await text_channel.delete()
         if voice_channel:
             await voice_channel.delete()
         
-        # Delete team
-        del teams[self.team_name]
-        with open(teams_file, 'w') as f:
-            json.dump(teams, f, indent=2)
-        
         await interaction.message.delete()
         await interaction.response.send_message("✅ Team deleted!", ephemeral=True)
 
@@ -513,32 +478,29 @@ class EditTeamModal(discord.ui.Modal, title="Edit Team Name"):
         self.add_item(self.new_name)
     
     async def on_submit(self, interaction: discord.Interaction):
-        teams_file = f'./Teams/{self.guild_id}.json'
-        with open(teams_file, 'r') as f:
-            teams = json.load(f)
-        
-        # Check if new name already exists
-        if self.new_name.value in teams and self.new_name.value != self.old_team_name:
-            await interaction.response.send_message("❌ A team with that name already exists!", ephemeral=True)
+        teams = get_team_cache()
+        await teams.load(self.guild_id)
+        team_data = teams.get_team(self.guild_id, self.old_team_name)
+        if not team_data:
+            await interaction.response.send_message("❌ Team not found!", ephemeral=True)
             return
         
-        # Update team name
-        team_data = teams[self.old_team_name]
-        del teams[self.old_team_name]
-        teams[self.new_name.value] = team_data
+        # Update team name (refused if the new name already exists)
+        try:
+            teams.rename_team(self.guild_id, self.old_team_name, self.new_name.value)
+        except TeamError as e:
+            await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+            return
         
         # Rename channels
-        text_channel = interaction.guild.get_channel(team_data['text_channel_id'])
-        voice_channel = interaction.guild.get_channel(team_data['voice_channel_id'])
+        text_channel = interaction.guild.get_channel(team_data.get('text_channel_id'))
+        voice_channel = interaction.guild.get_channel(team_data.get('voice_channel_id'))
         
         if text_channel:
             await text_channel.edit(name=f"team-{self.new_name.value.lower().replace(' ', '-')}")
         if voice_channel:
             await voice_channel.edit(name=self.new_name.value)
         
-        with open(teams_file, 'w') as f:
-            json.dump(teams, f, indent=2)
-        
         # Update message
         captain = interaction.guild.get_member(team_data['captain_id'])
         embed = discord.Embed(
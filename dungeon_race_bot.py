@@ -7,34 +7,18 @@ from datetime import datetime
 from pathlib import Path
 from discord.ext import commands, tasks
 from dotenv import load_dotenv
+from utils.bungie_api import BungieAPI
+from utils.race_scheduler import RaceScheduler
+from utils.race_timers import RaceTimers
+from utils.monitor_workers import MonitorWorkers, MONITOR_WORKERS
+from utils.state_store import get_store
+from utils.team_cache import get_team_cache
 
 load_dotenv()
 
 TOKEN = os.getenv('DISCORD_BOT_TOKEN')
 api_key = os.getenv('BUNGIE_API_KEY')
 
-# Create necessary directories
-for directory in ['Resources', 'RaceEvents', 'Teams', 'Results']:
-    Path(directory).mkdir(exist_ok=True)
-
-# Initialize dungeons.json if it doesn't exist
-dungeons_path = './Resources/dungeons.json'
-if not os.path.exists(dungeons_path):
-    default_dungeons = [
-        {"name": "The Shattered Throne", "hash": 2032534090},
-        {"name": "Pit of Heresy", "hash": 1375089621},
-        {"name": "Prophecy", "hash": 1077850348},
-        {"name": "Grasp of Avarice", "hash": 4078656646},
-        {"name": "Duality", "hash": 2823159265},
-        {"name": "Spire of the Watcher", "hash": 1262462921},
-        {"name": "Ghosts of the Deep", "hash": 313828469},
-        {"name": "Warlord's Ruin", "hash": 2004855007},
-        {"name": "Vesper's Host", "hash": 300092127},
-        {"name": "Equilibrium", "hash": 2727361621}
-    ]
-    with open(dungeons_path, 'w') as f:
-        json.dump(default_dungeons, f, indent=2)
-
 # Bot setup
 intents = discord.Intents.default()
 intents.message_content = True
@@ -43,6 +27,30 @@ intents.guilds = True
 
 bot = commands.Bot(command_prefix='!', intents=intents)
 
+async def on_race_warmup(guild_id, race_id):
+    """Race warm-up timer - resolve players before the start"""
+    from utils.race_monitor import warm_up_race
+    
+    guild = bot.get_guild(guild_id)
+    if guild:
+        await warm_up_race(bot, guild, race_id)
+
+async def on_race_start(guild_id, race_id):
+    """Race start timer - check it right away instead of waiting for the next tick"""
+    from utils.race_monitor import run_scheduled_checks
+    
+    print(f"🚦 {race_id} has started")
+    await run_scheduled_checks(bot, bot.race_scheduler)
+
+async def on_race_end(guild_id, race_id):
+    """Race end timer - final sweep, then winners and channel locks"""
+    from utils.race_monitor import finalize_race
+    
+    guild = bot.get_guild(guild_id)
+    if not guild:
+        return True
+    return await finalize_race(bot, guild, race_id, bot.race_scheduler)
+
 # Purple theme color
 PURPLE = 0x9B59B6
 
@@ -63,9 +71,19 @@ async def on_ready():
         print(f'Reinitialized team messages for {guild.name}')
         
     # Start monitoring task
-    if not race_monitor.is_running():
+    if bot.monitor_workers:
+        bot.monitor_workers.start(bot)
+    elif not race_monitor.is_running():
+        await bot.race_timers.rebuild()
+        bot.race_timers.start()
         race_monitor.start()
 
+@bot.event
+async def on_guild_join(guild):
+    # Monitor workers only poll the guilds they've been told about
+    if bot.monitor_workers:
+        bot.monitor_workers.update_guilds(bot.guilds)
+
 # Add interaction handler for buttons
 @bot.event
 async def on_interaction(interaction: discord.Interaction):
@@ -77,14 +95,12 @@ async def on_interaction(interaction: discord.Interaction):
     except Exception as e:
         print(f"Error in interaction handler: {e}")
 
-@tasks.loop(hours=1)
+@tasks.loop(minutes=1)
 async def race_monitor(): 
-    """Monitor active races and update leaderboards"""
-    from utils.race_monitor import check_race_completions
+    """Monitor active races and update leaderboards (only the races/teams the scheduler says are due)"""
+    from utils.race_monitor import run_scheduled_checks
     
-    for guild in bot.guilds:
-        await check_race_completions(bot, guild)
-        print(f'Next Result check in 1 Hour') 
+    await run_scheduled_checks(bot, bot.race_scheduler)
 
 @race_monitor.before_loop
 async def before_race_monitor():
@@ -94,13 +110,9 @@ async def reinitialize_team_messages(guild):
     """Reinitialize team message buttons after bot restart"""
     from cogs.team_commands import TeamView
     
-    teams_file = f'./Teams/{guild.id}.json'
-    if not os.path.exists(teams_file):
-        return
-    
     try:
-        with open(teams_file, 'r') as f:
-            teams_data = json.load(f)
+        await get_team_cache().load(guild.id)
+        teams_data = get_team_cache().load_teams(guild.id)
     except:
         return 
     
@@ -126,6 +138,54 @@ async def reinitialize_team_messages(guild):
         except Exception as e:
             print(f"  ✗ Error reinitializing team {team_name}: {e}")
 
+def setup_bot():
+    """
+    Directories, database and clients for the bot process
+    Called from main() rather than at import: monitor workers are spawned processes that
+    re-import this module, and must not build their own copies of all this.
+    """
+    # Create necessary directories
+    for directory in ['Resources', 'Cache']:
+        Path(directory).mkdir(exist_ok=True)
+    
+    # Open the races/teams/results database now (first run imports the old RaceEvents/, Teams/
+    # and Results/ JSON files) so monitor workers never race each other to migrate it
+    get_store()
+    
+    # Initialize dungeons.json if it doesn't exist
+    dungeons_path = './Resources/dungeons.json'
+    if not os.path.exists(dungeons_path):
+        default_dungeons = [
+            {"name": "The Shattered Throne", "hash": 2032534090},
+            {"name": "Pit of Heresy", "hash": 1375089621},
+            {"name": "Prophecy", "hash": 1077850348},
+            {"name": "Grasp of Avarice", "hash": 4078656646},
+            {"name": "Duality", "hash": 2823159265},
+            {"name": "Spire of the Watcher", "hash": 1262462921},
+            {"name": "Ghosts of the Deep", "hash": 313828469},
+            {"name": "Warlord's Ruin", "hash": 2004855007},
+            {"name": "Vesper's Host", "hash": 300092127},
+            {"name": "Equilibrium", "hash": 2727361621}
+        ]
+        with open(dungeons_path, 'w') as f:
+            json.dump(default_dungeons, f, indent=2)
+    
+    # Shared Bungie API client (one pooled HTTP session for the monitor and cogs)
+    bot.bungie_api = BungieAPI(api_key)
+    
+    # Decides when each race and team is checked next (see utils/race_scheduler.py)
+    bot.race_scheduler = RaceScheduler()
+    
+    # Fires race warm-up/start/end at the exact time (rebuilt from the state store on startup)
+    bot.race_timers = RaceTimers(on_race_start, on_race_end, on_race_warmup)
+    
+    # Optionally run the monitor in worker processes (MONITOR_WORKERS) so polling never blocks
+    # commands and buttons; the workers then own the race timers too
+    bot.monitor_workers = None
+    if MONITOR_WORKERS > 0:
+        bot.monitor_workers = MonitorWorkers(MONITOR_WORKERS, api_key)
+        bot.race_timers = bot.monitor_workers
+
 # Load cogs (command modules)
 async def load_cogs():
     cogs = [
@@ -141,6 +201,7 @@ async def load_cogs():
             print(f'Failed to load {cog}: {e}')
 
 async def main():
+    setup_bot()
     async with bot:
         await load_cogs()
         # Load your bot token from environment variable or config
@@ -148,7 +209,16 @@ async def main():
         if not TOKEN:
             print("Error: DISCORD_BOT_TOKEN not found in environment variables")
             return
-        await bot.start(TOKEN)
+        try:
+            await bot.start(TOKEN)
+        finally:
+            if bot.monitor_workers:
+                await bot.monitor_workers.stop()
+            else:
+                bot.race_timers.stop()
+            await bot.bungie_api.close()
+            await get_team_cache().flush_all()
+            await get_store().close()
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -1,132 +1,440 @@
 # utils/bungie_api.py
 import aiohttp
 import asyncio
+import os
+import random
 from datetime import datetime
+from utils.identity_cache import IdentityCache
+from utils.pgcr_cache import PGCRCache, PGCR_CACHE_MAX_BYTES
+from utils.history_cache import HistoryCache
+from utils.rate_limiter import RateLimiter, current_priority
+from utils.circuit_breaker import CircuitBreaker
+
+# Bungie ErrorCodes that mean "slow down" (ThrottleLimitExceeded*, PerEndpoint/PerApplication throttles)
+THROTTLE_ERROR_CODES = {31, 35, 36, 37, 51, 52, 1672}
+
+# ErrorCode 5 (SystemDisabled) is returned while Bungie is down for maintenance
+SYSTEM_DISABLED = 5
+
+# Retries for platform failures (5xx, timeouts), with exponential jittered backoff
+BUNGIE_RETRIES = int(os.getenv('BUNGIE_RETRIES', '3'))
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+# Activity history paging: runs per page, and a safety cap on pages per character
+HISTORY_PAGE_SIZE = 25
+HISTORY_MAX_PAGES = 40
+
+class BungieAPIError(Exception):
+    """A Bungie request failed (bad HTTP status, throttling or an error ErrorCode)"""
+    def __init__(self, message, status=None, error_code=None, throttle_seconds=0):
+        super().__init__(message)
+        self.status = status
+        self.error_code = error_code
+        self.throttle_seconds = throttle_seconds
+
+class BungieUnavailable(BungieAPIError):
+    """Bungie is in maintenance or failing - the circuit breaker is rejecting requests"""
 
 class BungieAPI:
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache_dir='./Cache', pgcr_max_bytes=PGCR_CACHE_MAX_BYTES):
         self.api_key = api_key
+        self.cache_dir = cache_dir
         self.base_url = "https://www.bungie.net/Platform"
         self.headers = {
             "X-API-Key": api_key
         }
+        
+        # Connection settings for the shared session
+        self.max_connections = int(os.getenv('BUNGIE_MAX_CONNECTIONS', '20'))
+        self.timeout = aiohttp.ClientTimeout(
+            total=float(os.getenv('BUNGIE_TIMEOUT', '30')),
+            connect=10
+        )
+        
+        self._session = None
+        
+        # Bungie name -> membership/characters, persisted under cache_dir
+        self.identities = IdentityCache(os.path.join(cache_dir, 'identities.json'))
+        
+        # Immutable PGCRs, compressed under cache_dir/PGCR with an in-memory LRU in front
+        self.pgcrs = PGCRCache(os.path.join(cache_dir, 'PGCR'), max_bytes=pgcr_max_bytes)
+        
+        # Per-character history and high-water mark, so polls only read new runs
+        self.histories = HistoryCache(os.path.join(cache_dir, 'history.json'))
+        
+        # Every request waits for a slot here; interactive lookups jump the queue
+        self.limiter = RateLimiter()
+        
+        # Stops all traffic after repeated outages until a probe succeeds
+        self.breaker = CircuitBreaker()
+        
+        # Requests currently in flight, so identical concurrent requests share one
+        self._inflight = {}
+    
+    @property
+    def session(self):
+        """
+        Shared aiohttp session, created on first use so it binds to the running loop.
+        Keeps connections to bungie.net alive between requests and caches DNS.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections,
+                ttl_dns_cache=300,
+                keepalive_timeout=60
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.headers,
+                timeout=self.timeout
+            )
+        return self._session
+    
+    async def close(self):
+        """Close the shared session and save resolved identities (call on bot shutdown)"""
+        try:
+            await self.identities.save()
+        except Exception as e:
+            print(f"⚠️  Could not save identity cache: {e}")
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def _request(self, method, url, priority=None, **kwargs):
+        """
+        Send a request through the circuit breaker and rate limiter
+        Timeouts and 5xx responses are retried with exponential jittered backoff.
+        Returns (HTTP status, parsed body); raises BungieAPIError if it never succeeds
+        and BungieUnavailable straight away while the circuit is open.
+        """
+        error = None
+        for attempt in range(BUNGIE_RETRIES + 1):
+            if not self.breaker.allow():
+                raise BungieUnavailable("Bungie API is unavailable - skipping request until it recovers")
+            
+            try:
+                status, body = await self._send(method, url, priority, **kwargs)
+            except BungieAPIError as e:
+                # Throttled: Bungie is up, the limiter is already waiting out the back-off
+                self.breaker.record_success()
+                error = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.breaker.record_failure()
+                error = BungieAPIError(f"Could not reach Bungie: {e!r}")
+            except asyncio.CancelledError:
+                self.breaker.cancel_probe()
+                raise
+            else:
+                error_code = body.get('ErrorCode')
+                if status < 500 and error_code != SYSTEM_DISABLED:
+                    self.breaker.record_success()
+                    return status, body
+                
+                self.breaker.record_failure()
+                error = BungieAPIError(
+                    f"Bungie platform error (HTTP {status}, ErrorCode {error_code})",
+                    status=status,
+                    error_code=error_code
+                )
+                if error_code == SYSTEM_DISABLED:
+                    # Maintenance won't be over in a few seconds - don't retry
+                    break
+            
+            if attempt < BUNGIE_RETRIES:
+                delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+                await asyncio.sleep(random.uniform(delay / 2, delay))
+        
+        raise error
+    
+    async def _send(self, method, url, priority, **kwargs):
+        """
+        Send one request once a rate limiter slot is free
+        Honours ThrottleSeconds and raises BungieAPIError when Bungie throttles us,
+        so callers never mistake it for "no data".
+        `priority` picks the limiter lane (default: the current task's, see set_priority).
+        """
+        await self.limiter.acquire(current_priority.get() if priority is None else priority)
+        
+        async with self.session.request(method, url, **kwargs) as response:
+            try:
+                data = await response.json(content_type=None)
+            except Exception:
+                data = None
+            
+            body = data if isinstance(data, dict) else {}
+            error_code = body.get('ErrorCode')
+            throttle_seconds = body.get('ThrottleSeconds') or 0
+            
+            if response.status == 429 or error_code in THROTTLE_ERROR_CODES:
+                retry_after = response.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    throttle_seconds = max(throttle_seconds, int(retry_after))
+                throttle_seconds = max(throttle_seconds, 1)
+                self.limiter.pause(throttle_seconds)
+                raise BungieAPIError(
+                    f"Throttled by Bungie (HTTP {response.status}, ErrorCode {error_code})",
+                    status=response.status,
+                    error_code=error_code,
+                    throttle_seconds=throttle_seconds
+                )
+            
+            # Bungie can ask us to wait before the next call even on success
+            if throttle_seconds:
+                self.limiter.pause(throttle_seconds)
+            
+            return response.status, body
     
-    async def search_player(self, bungie_name):
+    async def _single_flight(self, key, fetch):
+        """
+        Run fetch() once for every concurrent caller asking for the same key
+        All callers get the same parsed result (or the same error). The shared task is
+        shielded, so one caller giving up doesn't cancel it for the others.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        
+        return await asyncio.shield(task)
+    
+    async def search_player(self, bungie_name, priority=None):
         """
         Search for a player by Bungie name (e.g., "PlayerName#1234")
-        Returns membership info
+        Returns membership info (served from the identity cache when possible)
         """
         # Split name and code
         if '#' not in bungie_name:
             raise ValueError("Bungie name must include code (e.g., PlayerName#1234)")
         
-        name, code = bungie_name.split('#')
+        cached = self.identities.get(bungie_name)
+        if cached:
+            if cached.get('not_found'):
+                raise Exception(f"Player not found: {bungie_name}")
+            return cached
+        
+        name, code = bungie_name.rsplit('#', 1)
         
         url = f"{self.base_url}/Destiny2/SearchDestinyPlayerByBungieName/-1/"
         payload = {
             "displayName": name,
-            "displayNameCode": code
+            "displayNameCode": int(code)
         }
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=self.headers, json=payload) as response:
-                if response.status != 200:
-                    raise Exception(f"Failed to search player: {response.status}")
-                
-                data = await response.json()
-                
-                if not data.get('Response'):
-                    raise Exception(f"Player not found: {bungie_name}")
-                
-                return data['Response'][0]  # Return first result
+        status, data = await self._request('POST', url, priority=priority, json=payload)
+        if status != 200:
+            raise BungieAPIError(f"Failed to search player: {status}", status=status, error_code=data.get('ErrorCode'))
+        
+        if not data.get('Response'):
+            self.identities.put_not_found(bungie_name)
+            raise Exception(f"Player not found: {bungie_name}")
+        
+        player = data['Response'][0]  # Return first result
+        self.identities.put(bungie_name, player['membershipType'], player['membershipId'])
+        return player
     
-    async def get_activity_history(self, bungie_name, activity_hash, start_date, end_date, max_pages=5):
+    async def resolve_player(self, bungie_name, priority=None):
+        """
+        Resolve a Bungie name to (membership_type, membership_id, character_ids)
+        Character IDs are cached alongside the membership, so a warm lookup makes no requests
+        """
+        player = await self.search_player(bungie_name, priority=priority)
+        membership_type = player['membershipType']
+        membership_id = player['membershipId']
+        
+        characters = player.get('characters')
+        if not characters:
+            characters = await self.get_characters(membership_type, membership_id, priority=priority)
+            self.identities.set_characters(bungie_name, characters)
+        
+        return membership_type, membership_id, characters
+    
+    async def get_activity_history(self, bungie_name, activity_hash, start_date, end_date, max_pages=HISTORY_MAX_PAGES):
         """
         Get activity history for a player
         Filters by activity type (dungeon) and date range
         """
-        # First, get player info
-        player_info = await self.search_player(bungie_name)
-        membership_type = player_info['membershipType']
-        membership_id = player_info['membershipId']
+        # Get player info and character IDs
+        membership_type, membership_id, characters = await self.resolve_player(bungie_name)
         
-        # Get character IDs
-        characters = await self.get_characters(membership_type, membership_id)
+        # Page through every character's history at the same time
+        histories = await asyncio.gather(*[
+            self.get_character_history(
+                membership_type, membership_id, character_id, start_date, max_pages=max_pages
+            )
+            for character_id in characters
+        ], return_exceptions=True)
+        
+        # Merge into one time-ordered list, skipping characters that failed
+        matches = []
+        for history in histories:
+            if isinstance(history, Exception):
+                continue
+            for activity in history:
+                # Check if it's the right dungeon and inside the date range
+                activity_date = datetime.fromisoformat(activity['period'])
+                if activity['reference_id'] == activity_hash and start_date <= activity_date <= end_date:
+                    matches.append((activity_date, activity['instance_id']))
+        matches.sort(key=lambda match: match[0])
         
         all_activities = []
+        for activity_date, instance_id in matches:
+            # Get full PGCR (Post Game Carnage Report)
+            pgcr = await self.get_pgcr(instance_id)
+            if pgcr:
+                all_activities.append(pgcr)
         
-        # Check each character
-        for character_id in characters:
-            page = 0
-            while page < max_pages:
-                url = (
-                    f"{self.base_url}/Destiny2/{membership_type}/Account/{membership_id}/"
-                    f"Character/{character_id}/Stats/Activities/"
-                    f"?mode=82&page={page}&count=25"  # mode 82 is dungeons
-                )
+        return all_activities
+    
+    async def get_character_history(self, membership_type, membership_id, character_id, since,
+                                    mode=82, max_pages=HISTORY_MAX_PAGES):
+        """
+        One character's activity history back to `since`, newest first
+        Pages only until it reaches the newest run already stored (or `since`, if no stored history
+        covers it) and merges what it saw into the history cache.
+        Each run is {'instance_id', 'period', 'reference_id', 'completed', 'duration'}.
+        """
+        cursor = self.histories.get(membership_id, character_id, since)
+        if cursor:
+            # Only runs newer than the stored ones are needed, however recent `since` is
+            stop_instance = cursor['newest_instance']
+            stop_before = datetime.fromisoformat(
+                cursor['activities'][0]['period'] if cursor['activities'] else cursor['covered_since']
+            )
+        else:
+            stop_instance = None
+            stop_before = since
+        
+        new_activities = []
+        complete = False  # reached the cursor, `since` or the end of the history
+        page = 0
+        while page < max_pages:
+            activities = await self.get_activity_page(
+                membership_type, membership_id, character_id,
+                page=page, count=HISTORY_PAGE_SIZE, mode=mode
+            )
+            
+            done = complete = not activities or len(activities) < HISTORY_PAGE_SIZE
+            for activity in activities:
+                details = activity.get('activityDetails', {})
+                period = datetime.fromisoformat(activity.get('period').replace('Z', '+00:00'))
+                
+                if (stop_instance and details.get('instanceId') == stop_instance) or period < stop_before:
+                    done = complete = True
+                    break
                 
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url, headers=self.headers) as response:
-                        if response.status != 200:
-                            break
-                        
-                        data = await response.json()
-                        activities = data.get('Response', {}).get('activities', [])
-                        
-                        if not activities:
-                            break
-                        
-                        # Filter by activity hash and date
-                        for activity in activities:
-                            # Check if it's the right dungeon
-                            if activity.get('activityDetails', {}).get('referenceId') != activity_hash:
-                                continue
-                            
-                            # Check date range
-                            activity_date = datetime.fromisoformat(
-                                activity.get('period').replace('Z', '+00:00')
-                            )
-                            
-                            if start_date <= activity_date <= end_date:
-                                # Get full PGCR (Post Game Carnage Report)
-                                pgcr = await self.get_pgcr(activity.get('activityDetails', {}).get('instanceId'))
-                                if pgcr:
-                                    all_activities.append(pgcr)
-                        
-                        page += 1
+                values = activity.get('values', {})
+                new_activities.append({
+                    'instance_id': details.get('instanceId'),
+                    'period': period.isoformat(),
+                    'reference_id': details.get('referenceId'),
+                    'completed': values.get('completed', {}).get('basic', {}).get('value', 0),
+                    'duration': values.get('activityDurationSeconds', {}).get('basic', {}).get('value', 0)
+                })
+            
+            if done:
+                break
+            page += 1
         
-        return all_activities
+        if cursor:
+            # Everything older was already stored on a previous call
+            activities = new_activities + cursor['activities']
+            covered_since = datetime.fromisoformat(cursor['covered_since'])
+        else:
+            activities = new_activities
+            covered_since = since
+        
+        # Stopped at the page cap - there may be a gap, so don't store coverage it doesn't have
+        if complete:
+            self.histories.put(membership_id, character_id, activities, covered_since)
+        
+        return [
+            activity for activity in activities
+            if datetime.fromisoformat(activity['period']) >= since
+        ]
     
-    async def get_characters(self, membership_type, membership_id):
+    async def get_activity_page(self, membership_type, membership_id, character_id, page=0, count=25, mode=82):
+        """
+        Get one page of a character's activity history (mode 82 is dungeons)
+        Returns the activity list (empty past the last page)
+        Concurrent requests for the same page share one request.
+        """
+        key = ('activities', membership_id, character_id, page, count, mode)
+        return await self._single_flight(key, lambda: self._fetch_activity_page(
+            membership_type, membership_id, character_id, page, count, mode
+        ))
+    
+    async def _fetch_activity_page(self, membership_type, membership_id, character_id, page, count, mode):
+        url = (
+            f"{self.base_url}/Destiny2/{membership_type}/Account/{membership_id}/"
+            f"Character/{character_id}/Stats/Activities/"
+            f"?mode={mode}&page={page}&count={count}"
+        )
+        
+        status, data = await self._request('GET', url)
+        if status != 200:
+            raise BungieAPIError(f"Failed to get activity history: {status}", status=status, error_code=data.get('ErrorCode'))
+        
+        return (data.get('Response') or {}).get('activities', [])
+    
+    async def get_characters(self, membership_type, membership_id, priority=None):
         """Get character IDs for a player"""
         url = f"{self.base_url}/Destiny2/{membership_type}/Profile/{membership_id}/?components=200"
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=self.headers) as response:
-                if response.status != 200:
-                    raise Exception(f"Failed to get characters: {response.status}")
-                
-                data = await response.json()
-                characters_data = data.get('Response', {}).get('characters', {}).get('data', {})
-                
-                return list(characters_data.keys())
+        status, data = await self._request('GET', url, priority=priority)
+        if status != 200:
+            raise BungieAPIError(f"Failed to get characters: {status}", status=status, error_code=data.get('ErrorCode'))
+        
+        characters_data = (data.get('Response') or {}).get('characters', {}).get('data', {})
+        
+        return list(characters_data.keys())
+    
+    async def get_current_activities(self, membership_type, membership_id, priority=None):
+        """
+        Activity hash each character is in right now, {character_id: hash} (0 in orbit/offline)
+        One cheap profile request (CharacterActivities component)
+        """
+        url = f"{self.base_url}/Destiny2/{membership_type}/Profile/{membership_id}/?components=204"
+        
+        status, data = await self._request('GET', url, priority=priority)
+        if status != 200:
+            raise BungieAPIError(f"Failed to get current activities: {status}", status=status, error_code=data.get('ErrorCode'))
+        
+        activities_data = (data.get('Response') or {}).get('characterActivities', {}).get('data', {})
+        
+        return {
+            character_id: activity.get('currentActivityHash', 0)
+            for character_id, activity in activities_data.items()
+        }
     
     async def get_pgcr(self, instance_id):
-        """Get Post Game Carnage Report for an activity"""
+        """
+        Get Post Game Carnage Report for an activity (cached forever once fetched)
+        Concurrent requests for the same instance share one download.
+        """
+        pgcr = await self.pgcrs.get(instance_id)
+        if pgcr:
+            return pgcr
+        
+        return await self._single_flight(('pgcr', str(instance_id)), lambda: self._fetch_pgcr(instance_id))
+    
+    async def _fetch_pgcr(self, instance_id):
         url = f"{self.base_url}/Destiny2/Stats/PostGameCarnageReport/{instance_id}/"
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=self.headers) as response:
-                if response.status != 200:
-                    return None
-                
-                data = await response.json()
-                return data.get('Response')
+        status, data = await self._request('GET', url)
+        if status != 200:
+            return None
+        
+        pgcr = data.get('Response')
+        await self.pgcrs.put(instance_id, pgcr)
+        return pgcr
     
-    async def validate_bungie_name(self, bungie_name):
+    async def validate_bungie_name(self, bungie_name, priority=None):
         """Validate that a Bungie name exists"""
         try:
-            await self.search_player(bungie_name)
+            await self.search_player(bungie_name, priority=priority)
             return True
         except:
             return False
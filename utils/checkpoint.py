@@ -0,0 +1,45 @@
+# utils/checkpoint.py
+import os
+import time
+
+# Team checks older than this are done again rather than resumed (runs may have been added since)
+CHECKPOINT_MAX_AGE_SECONDS = int(os.getenv('CHECKPOINT_MAX_AGE_MINUTES', '15')) * 60
+
+class RaceCheckpoint:
+    """
+    Per-team progress of a race check that hasn't finished yet
+    Every team is written to the state store as soon as its check is done (its result - the runs
+    it found, validated and rejected - plus the captain's history cursors). The rows are removed
+    once the race's results are saved, so if they're still there the previous check was
+    interrupted and the next one picks up from them - unless they're too old to trust.
+    """
+    def __init__(self, store, guild_id, race_id, race_data):
+        self.store = store
+        self.key = (guild_id, race_id, race_data)
+        self.teams = {}
+    
+    async def load(self):
+        """Pick up whatever an interrupted check left behind"""
+        try:
+            teams = await self.store.load_checkpoint(*self.key)
+        except Exception as e:
+            print(f"   ⚠️  Could not load checkpoint ({e}), ignoring it")
+            teams = {}
+        
+        cutoff = time.time() - CHECKPOINT_MAX_AGE_SECONDS
+        self.teams = {
+            team_name: entry for team_name, entry in teams.items() if entry.get('saved_at', 0) >= cutoff
+        }
+        if len(self.teams) < len(teams):
+            print(f"   ⏳ Ignoring {len(teams) - len(self.teams)} stale checkpointed team(s)")
+        return self
+    
+    async def put_team(self, team_name, result, cursors):
+        """Record a finished team check (its own small transaction)"""
+        self.teams[team_name] = {'result': result, 'cursors': cursors, 'saved_at': time.time()}
+        await self.store.put_checkpoint(*self.key, team_name, self.teams[team_name])
+    
+    async def clear(self):
+        """The check finished and its results are saved - nothing to resume"""
+        self.teams = {}
+        await self.store.clear_checkpoint(*self.key)
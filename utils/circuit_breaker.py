@@ -0,0 +1,78 @@
+# utils/circuit_breaker.py
+import os
+import time
+
+# Consecutive platform failures before we stop calling Bungie, and how long to wait before probing
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BUNGIE_BREAKER_THRESHOLD', '5'))
+BREAKER_RESET_TIMEOUT = float(os.getenv('BUNGIE_BREAKER_RESET_SECONDS', '60'))
+BREAKER_MAX_RESET_TIMEOUT = 900
+
+class CircuitBreaker:
+    """
+    Stops traffic to Bungie after repeated platform failures (maintenance, 5xx, timeouts)
+    closed    -> requests flow normally
+    open      -> requests fail immediately until the cooldown passes
+    half_open -> one probe request is let through; success closes, failure re-opens
+                 with a longer cooldown
+    """
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout=BREAKER_RESET_TIMEOUT, max_reset_timeout=BREAKER_MAX_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.cooldown = reset_timeout
+        self.probing = False
+    
+    @property
+    def is_open(self):
+        """True while requests would be rejected without trying (cooldown not over yet)"""
+        return self.state == 'open' and time.monotonic() - self.opened_at < self.cooldown
+    
+    def allow(self):
+        """Return True if a request may be sent now"""
+        if self.state == 'closed':
+            return True
+        
+        if self.state == 'open':
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.state = 'half_open'
+            self.probing = False
+        
+        # Half open: a single probe at a time
+        if self.probing:
+            return False
+        self.probing = True
+        return True
+    
+    def record_success(self):
+        if self.state != 'closed':
+            print("✅ Bungie API is responding again - resuming requests")
+        
+        self.state = 'closed'
+        self.failures = 0
+        self.cooldown = self.reset_timeout
+        self.probing = False
+    
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        
+        if self.state == 'half_open':
+            self.cooldown = min(self.cooldown * 2, self.max_reset_timeout)
+            self._open()
+        elif self.state == 'closed' and self.failures >= self.failure_threshold:
+            self._open()
+    
+    def cancel_probe(self):
+        """The probe request was cancelled before it finished - let another one try"""
+        self.probing = False
+    
+    def _open(self):
+        self.state = 'open'
+        self.opened_at = time.monotonic()
+        print(f"⛔ Bungie API looks down ({self.failures} failures in a row) - pausing requests for {self.cooldown:.0f}s")
@@ -0,0 +1,59 @@
+# utils/file_cache.py
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Disk reads and writes of the Bungie caches under Cache/ run on this one thread, so big files
+# never stall the event loop or queue behind the state store's thread (one thread also keeps
+# the writes to each file in order)
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cache-files')
+
+async def run_in_cache_thread(function, *args):
+    """Run blocking cache file work off the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(_executor, function, *args)
+
+class JSONFileCache:
+    """
+    Entries kept in memory and persisted as one JSON file
+    Changes only mark the cache dirty; save() writes the whole file once per cycle on the cache
+    thread (temp file + rename, so a crash never leaves it half written).
+    """
+    label = 'cache'
+    
+    def __init__(self, path):
+        self.path = path
+        self.entries = self._load()
+        self.dirty = False
+    
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"⚠️  Could not load {self.label} ({e}), starting empty")
+            return {}
+    
+    async def save(self):
+        """Write pending changes to disk (nothing to do if there are none)"""
+        if not self.dirty:
+            return
+        
+        # A shallow copy, so checks running meanwhile can keep changing the cache
+        entries = dict(self.entries)
+        self.dirty = False
+        try:
+            await run_in_cache_thread(self._write, entries)
+        except Exception:
+            self.dirty = True  # written again next time
+            raise
+    
+    def _write(self, entries):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,63 @@
+# utils/history_cache.py
+from datetime import datetime, timedelta
+import pytz
+from utils.file_cache import JSONFileCache
+
+# Runs older than this are forgotten (no race looks that far back)
+HISTORY_RETENTION_DAYS = 90
+
+class HistoryCache(JSONFileCache):
+    """
+    Per-character dungeon history with a high-water mark
+    For each character we keep the runs already seen (newest first), the newest instanceId,
+    and how far back the stored history is complete. The next poll only needs to page
+    until it reaches that newest instanceId.
+    """
+    label = 'history cache'
+    
+    def __init__(self, path='./Cache/history.json', retention_days=HISTORY_RETENTION_DAYS):
+        super().__init__(path)
+        self.retention = timedelta(days=retention_days)
+    
+    @staticmethod
+    def _key(membership_id, character_id):
+        return f'{membership_id}:{character_id}'
+    
+    def get(self, membership_id, character_id, since):
+        """
+        Return the cursor for a character if its stored history reaches back to `since`
+        ({'newest_instance', 'covered_since', 'activities'}), otherwise None
+        """
+        entry = self.entries.get(self._key(membership_id, character_id))
+        if not entry:
+            return None
+        
+        if datetime.fromisoformat(entry['covered_since']) > since:
+            return None
+        
+        return entry
+    
+    def put(self, membership_id, character_id, activities, covered_since):
+        """Store a character's history (newest first) that is complete back to covered_since"""
+        cutoff = datetime.now(pytz.UTC) - self.retention
+        activities = [
+            activity for activity in activities
+            if datetime.fromisoformat(activity['period']) >= cutoff
+        ]
+        
+        self.entries[self._key(membership_id, character_id)] = {
+            'newest_instance': activities[0]['instance_id'] if activities else None,
+            'covered_since': max(covered_since, cutoff).isoformat(),
+            'activities': activities
+        }
+        self.dirty = True
+    
+    def export(self, membership_id):
+        """Every stored cursor of one player, {key: entry} (for checkpoints)"""
+        prefix = f'{membership_id}:'
+        return {key: entry for key, entry in self.entries.items() if key.startswith(prefix)}
+    
+    def restore(self, entries):
+        """Put back cursors saved by export()"""
+        self.entries.update(entries)
+        self.dirty = True
@@ -0,0 +1,71 @@
+# utils/history_planner.py
+import asyncio
+from utils.rate_limiter import set_flow
+
+def _player_key(bungie_name):
+    # Bungie names are case-insensitive
+    return bungie_name.strip().lower()
+
+class HistoryPlanner:
+    """
+    Per-cycle fan-out hub for activity history
+    Collects every (player, dungeon, race window) the monitor needs across all guilds,
+    fetches each player's dungeon history once (back to their earliest race start),
+    then hands every race the completions that match its dungeon and window.
+    Races can start checking as soon as their own players' histories are in.
+    """
+    def __init__(self):
+        self.demands = {}  # player key -> {'name', 'since', 'races', 'flow'}
+        self.tasks = {}  # player key -> task fetching the merged history
+    
+    def add(self, bungie_name, dungeon_hash, start_date, end_date, flow=None):
+        """
+        Register that a race needs this player's runs of a dungeon between two dates
+        `flow` (the guild ID) is who the requests are billed to in the rate limiter
+        """
+        key = _player_key(bungie_name)
+        demand = self.demands.setdefault(key, {'name': bungie_name, 'since': start_date, 'races': 0, 'flow': flow})
+        demand['since'] = min(demand['since'], start_date)
+        demand['races'] += 1
+    
+    def start(self, get_player_history, concurrency=5):
+        """Start fetching every registered player's history once, a few players at a time"""
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def fetch_player(demand):
+            set_flow(demand['flow'])
+            async with semaphore:
+                return await get_player_history(demand['name'], demand['since'])
+        
+        for key, demand in self.demands.items():
+            if key not in self.tasks:
+                self.tasks[key] = asyncio.create_task(fetch_player(demand))
+    
+    async def fetch(self, get_player_history, concurrency=5):
+        """Fetch every registered player's history and wait for all of them"""
+        self.start(get_player_history, concurrency)
+        await self.wait()
+    
+    async def wait(self):
+        """Wait for every started fetch to finish"""
+        if not self.tasks:
+            return
+        
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        
+        shared = sum(1 for demand in self.demands.values() if demand['races'] > 1)
+        print(f"📥 Fetched history for {len(self.demands)} player(s) ({shared} shared by several races)")
+    
+    async def history_for(self, bungie_name, since):
+        """
+        Return the prefetched history for a player (waiting for it if it's still loading),
+        or None if it wasn't planned or doesn't reach back far enough.
+        Re-raises the error if the fetch failed.
+        """
+        key = _player_key(bungie_name)
+        demand = self.demands.get(key)
+        if key not in self.tasks or demand['since'] > since:
+            return None
+        
+        # Shielded: a cancelled race check mustn't cancel a fetch other races are waiting on
+        return await asyncio.shield(self.tasks[key])
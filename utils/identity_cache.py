@@ -0,0 +1,66 @@
+# utils/identity_cache.py
+import time
+from utils.file_cache import JSONFileCache
+
+# How long a resolved player stays cached, and how long a "not found" answer is remembered
+IDENTITY_TTL = 7 * 24 * 3600
+NOT_FOUND_TTL = 3600
+
+class IdentityCache(JSONFileCache):
+    """
+    Persistent Bungie name -> membership cache
+    Stores membershipType, membershipId and character IDs so they survive restarts
+    """
+    label = 'identity cache'
+    
+    def __init__(self, path='./Cache/identities.json', ttl=IDENTITY_TTL, not_found_ttl=NOT_FOUND_TTL):
+        super().__init__(path)
+        self.ttl = ttl
+        self.not_found_ttl = not_found_ttl
+    
+    @staticmethod
+    def _key(bungie_name):
+        # Bungie names are case-insensitive
+        return bungie_name.strip().lower()
+    
+    def get(self, bungie_name):
+        """
+        Return the cached entry for a Bungie name, or None if unknown or expired
+        A "not found" entry has {'not_found': True}
+        """
+        entry = self.entries.get(self._key(bungie_name))
+        if not entry:
+            return None
+        
+        ttl = self.not_found_ttl if entry.get('not_found') else self.ttl
+        if time.time() - entry.get('cached_at', 0) > ttl:
+            return None
+        
+        return entry
+    
+    def put(self, bungie_name, membership_type, membership_id, characters=None):
+        """Remember a resolved player"""
+        self.entries[self._key(bungie_name)] = {
+            'membershipType': membership_type,
+            'membershipId': membership_id,
+            'characters': characters,
+            'cached_at': time.time()
+        }
+        self.dirty = True
+    
+    def put_not_found(self, bungie_name):
+        """Remember that Bungie has no player with this name"""
+        self.entries[self._key(bungie_name)] = {
+            'not_found': True,
+            'cached_at': time.time()
+        }
+        self.dirty = True
+    
+    def set_characters(self, bungie_name, characters):
+        """Attach character IDs to an already cached player"""
+        entry = self.entries.get(self._key(bungie_name))
+        if not entry or entry.get('not_found'):
+            return
+        
+        entry['characters'] = characters
+        self.dirty = True
@@ -0,0 +1,287 @@
+# utils/monitor_workers.py
+import asyncio
+import itertools
+import multiprocessing
+import os
+import traceback
+from utils.bungie_api import BungieAPI
+from utils.pgcr_cache import PGCR_CACHE_MAX_BYTES
+from utils.race_scheduler import RaceScheduler
+from utils.race_timers import RaceTimers
+from utils.state_store import get_store
+
+# Number of race monitor worker processes (0 = run the monitor on the bot's own event loop)
+MONITOR_WORKERS = int(os.getenv('MONITOR_WORKERS', '0'))
+
+# Seconds between scheduler ticks inside a worker
+WORKER_TICK_SECONDS = 60
+
+# Seconds to wait for a worker to answer /refresh-race (a dead or stuck worker never will)
+REFRESH_TIMEOUT_SECONDS = 600
+
+# Seconds between checks that every worker process is still running
+WORKER_WATCH_SECONDS = 30
+
+class WorkerGuild:
+    """Just enough of a discord.Guild for the monitor inside a worker (ID and name)"""
+    def __init__(self, guild_id, name=None):
+        self.id = guild_id
+        self.name = name or str(guild_id)
+
+class WorkerBot:
+    """
+    Stands in for the bot inside a worker process
+    Owns its own Bungie client, scheduler and race timers; anything that needs Discord
+    (leaderboards, winners, channel locks) is sent back to the bot process with publish().
+    The client's caches live in the worker's own directory (Cache/worker-N/) with its share
+    of the PGCR disk budget, so workers never overwrite each other's cache files.
+    """
+    def __init__(self, api_key, outbox, worker_id=0, worker_count=1):
+        self.bungie_api = BungieAPI(
+            api_key,
+            cache_dir=os.path.join('./Cache', f'worker-{worker_id}'),
+            pgcr_max_bytes=PGCR_CACHE_MAX_BYTES // worker_count
+        )
+        self.race_scheduler = RaceScheduler()
+        self.race_timers = None
+        self.guilds = []
+        self.outbox = outbox
+    
+    def get_guild(self, guild_id):
+        # Timers can fire before the bot has sent the guild list - the ID is all the monitor needs
+        return next((guild for guild in self.guilds if guild.id == guild_id), None) or WorkerGuild(guild_id)
+    
+    def publish(self, kind, guild_id, *args):
+        self.outbox.put((kind, guild_id, *args))
+
+def worker_main(worker_id, worker_count, api_key, inbox, outbox):
+    """Entry point of a monitor worker process"""
+    try:
+        asyncio.run(_run_worker(worker_id, worker_count, api_key, inbox, outbox))
+    except KeyboardInterrupt:
+        pass
+
+async def _run_worker(worker_id, worker_count, api_key, inbox, outbox):
+    from utils.race_monitor import run_scheduled_checks, finalize_race, warm_up_race, refresh_race
+    
+    bot = WorkerBot(api_key, outbox, worker_id, worker_count)
+    
+    # Bungie's rate limit is per API key, so the workers split it
+    bot.bungie_api.limiter.rate /= worker_count
+    
+    async def on_race_warmup(guild_id, race_id):
+        await warm_up_race(bot, bot.get_guild(guild_id), race_id)
+    
+    async def on_race_start(guild_id, race_id):
+        print(f"🚦 {race_id} has started")
+        await run_scheduled_checks(bot, bot.race_scheduler)
+    
+    async def on_race_end(guild_id, race_id):
+        return await finalize_race(bot, bot.get_guild(guild_id), race_id, bot.race_scheduler)
+    
+    bot.race_timers = RaceTimers(on_race_start, on_race_end, on_race_warmup)
+    await bot.race_timers.rebuild(guild_filter=lambda guild_id: guild_id % worker_count == worker_id)
+    bot.race_timers.start()
+    
+    wakeup = asyncio.Event()
+    
+    async def tick():
+        while True:
+            wakeup.clear()
+            try:
+                await run_scheduled_checks(bot, bot.race_scheduler)
+            except Exception as e:
+                print(f"❌ Monitor worker {worker_id} tick failed: {e}")
+                traceback.print_exc()
+            
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=WORKER_TICK_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    
+    tick_task = asyncio.create_task(tick())
+    
+    refreshes = set()
+    
+    async def run_refresh(guild_id, race_id, request_id):
+        try:
+            summary = await refresh_race(bot, bot.get_guild(guild_id), race_id)
+        except Exception as e:
+            print(f"❌ Refresh of {race_id} failed: {e}")
+            summary = None
+        bot.publish('refreshed', guild_id, request_id, summary)
+    print(f"🧵 Monitor worker {worker_id + 1}/{worker_count} started (pid {os.getpid()})")
+    
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            message = await loop.run_in_executor(None, inbox.get)
+            kind = message[0]
+            
+            if kind == 'stop':
+                break
+            elif kind == 'guilds':
+                bot.guilds = [WorkerGuild(guild_id, name) for guild_id, name in message[1]]
+                wakeup.set()  # check the new guilds now rather than on the next tick
+            elif kind == 'schedule_race':
+                bot.race_timers.schedule_race(*message[1:])
+            elif kind == 'cancel_race':
+                bot.race_timers.cancel_race(*message[1:])
+            elif kind == 'refresh_race':
+                task = asyncio.create_task(run_refresh(*message[1:]))
+                refreshes.add(task)
+                task.add_done_callback(refreshes.discard)
+    finally:
+        tick_task.cancel()
+        bot.race_timers.stop()
+        await bot.bungie_api.close()
+        await get_store().close()
+
+class MonitorWorkers:
+    """
+    Runs the race monitor in worker processes, sharded by guild ID
+    The bot process keeps only the Discord side (leaderboards, winners, channel locks).
+    Also stands in for bot.race_timers, so race commands reach the worker that owns the guild.
+    """
+    def __init__(self, count, api_key):
+        self.count = count
+        self.api_key = api_key
+        self.bot = None
+        
+        self.context = multiprocessing.get_context('spawn')
+        self.inboxes = [self.context.Queue() for _ in range(count)]
+        self.outbox = self.context.Queue()
+        self.processes = []
+        self._reader = None
+        self._watcher = None
+        
+        self._request_ids = itertools.count()
+        self.pending = {}  # request ID -> (worker ID, future waiting for its answer)
+    
+    def shard(self, guild_id):
+        return guild_id % self.count
+    
+    def start(self, bot):
+        """Start the workers (once) and send them the current guild list"""
+        self.bot = bot
+        
+        if not self.processes:
+            self.processes = [self._spawn(worker_id) for worker_id in range(self.count)]
+        
+        self.update_guilds(bot.guilds)
+        
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.create_task(self._read_results())
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.create_task(self._watch())
+    
+    def _spawn(self, worker_id):
+        process = self.context.Process(
+            target=worker_main,
+            args=(worker_id, self.count, self.api_key, self.inboxes[worker_id], self.outbox),
+            name=f'race-monitor-{worker_id}',
+            daemon=True
+        )
+        process.start()
+        return process
+    
+    async def _watch(self):
+        """Restart workers that died, so their guilds keep being polled and finalized"""
+        while True:
+            await asyncio.sleep(WORKER_WATCH_SECONDS)
+            for worker_id, process in enumerate(self.processes):
+                if process.is_alive():
+                    continue
+                
+                print(f"❌ Monitor worker {worker_id + 1}/{self.count} died (exit code {process.exitcode}) - restarting it")
+                
+                # Its refreshes will never be answered
+                for request_id, (owner, future) in list(self.pending.items()):
+                    if owner == worker_id and not future.done():
+                        future.set_result(None)
+                
+                # A fresh inbox (the dead process may have died holding the old one's lock). The new
+                # process rebuilds its race timers from the state store.
+                self.inboxes[worker_id] = self.context.Queue()
+                self.processes[worker_id] = self._spawn(worker_id)
+                self.update_guilds(self.bot.guilds, worker_id)
+    
+    def update_guilds(self, guilds, only_worker=None):
+        """Tell each worker (or just one) which guilds it owns"""
+        for worker_id, inbox in enumerate(self.inboxes):
+            if only_worker is not None and worker_id != only_worker:
+                continue
+            inbox.put(('guilds', [(guild.id, guild.name) for guild in guilds if self.shard(guild.id) == worker_id]))
+    
+    def schedule_race(self, guild_id, race_id, race_data):
+        self.inboxes[self.shard(guild_id)].put(('schedule_race', guild_id, race_id, race_data))
+    
+    def cancel_race(self, guild_id, race_id):
+        self.inboxes[self.shard(guild_id)].put(('cancel_race', guild_id, race_id))
+    
+    async def refresh_race(self, guild_id, race_id):
+        """Have the worker that owns the guild check a race now; returns its new runs per team"""
+        request_id = next(self._request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = (self.shard(guild_id), future)
+        
+        self.inboxes[self.shard(guild_id)].put(('refresh_race', guild_id, race_id, request_id))
+        try:
+            summary = await asyncio.wait_for(future, timeout=REFRESH_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"Monitor worker did not answer within {REFRESH_TIMEOUT_SECONDS}s")
+        finally:
+            self.pending.pop(request_id, None)
+        
+        if summary is None:
+            raise RuntimeError(f"Monitor worker could not check {race_id}")
+        return summary
+    
+    async def _read_results(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await loop.run_in_executor(None, self.outbox.get)
+            if message is None:
+                break
+            
+            try:
+                await self._handle(message)
+            except Exception as e:
+                print(f"❌ Error handling monitor worker message '{message[0]}': {e}")
+                traceback.print_exc()
+    
+    async def _handle(self, message):
+        from utils.race_monitor import update_leaderboard, announce_race_end
+        
+        kind, guild_id, *args = message
+        
+        if kind == 'refreshed':
+            request_id, summary = args
+            _, future = self.pending.get(request_id, (None, None))
+            if future and not future.done():
+                future.set_result(summary)
+            return
+        
+        guild = self.bot.get_guild(guild_id)
+        if not guild:
+            return
+        
+        if kind == 'leaderboard':
+            await update_leaderboard(self.bot, guild, *args)
+        elif kind == 'race_end':
+            await announce_race_end(self.bot, guild, *args)
+    
+    async def stop(self):
+        """Ask the workers to finish and wait for them"""
+        if self._watcher:
+            self._watcher.cancel()
+        for inbox in self.inboxes:
+            inbox.put(('stop',))
+        self.outbox.put(None)
+        
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join, 10)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
@@ -0,0 +1,145 @@
+# utils/pgcr_cache.py
+import gzip
+import json
+import os
+import time
+from collections import OrderedDict
+from utils.file_cache import run_in_cache_thread
+
+# Disk budget for stored PGCRs and how many parsed reports to keep in memory
+PGCR_CACHE_MAX_BYTES = int(float(os.getenv('PGCR_CACHE_MAX_MB', '256')) * 1024 * 1024)
+PGCR_MEMORY_ITEMS = 256
+
+class PGCRCache:
+    """
+    Post Game Carnage Report store keyed by instanceId
+    A PGCR never changes once it exists, so entries are never refreshed - only evicted
+    (least recently used first) when the disk budget is exceeded.
+    """
+    def __init__(self, path='./Cache/PGCR', max_bytes=PGCR_CACHE_MAX_BYTES, memory_items=PGCR_MEMORY_ITEMS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        
+        self.memory = OrderedDict()  # instance_id -> parsed PGCR
+        self.files = {}  # instance_id -> (size in bytes, last access time)
+        self.total_bytes = 0
+        self._writing = set()  # instance IDs being written right now
+        
+        os.makedirs(self.path, exist_ok=True)
+        self._scan()
+    
+    def _file_path(self, instance_id):
+        return os.path.join(self.path, f'{instance_id}.json.gz')
+    
+    def _scan(self):
+        """Index the files already on disk (sizes and access order)"""
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith('.json.gz'):
+                continue
+            
+            stat = entry.stat()
+            instance_id = entry.name[:-len('.json.gz')]
+            self.files[instance_id] = (stat.st_size, stat.st_mtime)
+            self.total_bytes += stat.st_size
+    
+    def _remember(self, instance_id, pgcr):
+        self.memory[instance_id] = pgcr
+        self.memory.move_to_end(instance_id)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+    
+    async def get(self, instance_id):
+        """Return the stored PGCR for an instance, or None if it has never been saved"""
+        instance_id = str(instance_id)
+        
+        if instance_id in self.memory:
+            self.memory.move_to_end(instance_id)
+            return self.memory[instance_id]
+        
+        if instance_id not in self.files:
+            return None
+        
+        # Read (and touch, so eviction sees it as recently used) on the cache thread
+        now = time.time()
+        try:
+            pgcr = await run_in_cache_thread(self._read, instance_id, now)
+        except Exception as e:
+            if instance_id in self.files:  # (not just evicted while we waited)
+                print(f"⚠️  Dropping unreadable cached PGCR {instance_id}: {e}")
+                await self._delete([instance_id])
+            return None
+        
+        if instance_id in self.files:
+            size, _ = self.files[instance_id]
+            self.files[instance_id] = (size, now)
+        
+        self._remember(instance_id, pgcr)
+        return pgcr
+    
+    def _read(self, instance_id, now):
+        with gzip.open(self._file_path(instance_id), 'rt', encoding='utf-8') as f:
+            pgcr = json.load(f)
+        try:
+            os.utime(self._file_path(instance_id), (now, now))
+        except OSError:
+            pass
+        return pgcr
+    
+    async def put(self, instance_id, pgcr):
+        """Store a PGCR (compressed) and evict old ones if over the byte budget"""
+        if not pgcr:
+            return
+        
+        instance_id = str(instance_id)
+        self._remember(instance_id, pgcr)
+        
+        if instance_id in self.files or instance_id in self._writing:
+            return
+        
+        self._writing.add(instance_id)
+        try:
+            size = await run_in_cache_thread(self._write, instance_id, pgcr)
+        finally:
+            self._writing.discard(instance_id)
+        
+        self.files[instance_id] = (size, time.time())
+        self.total_bytes += size
+        
+        await self._evict()
+    
+    def _write(self, instance_id, pgcr):
+        file_path = self._file_path(instance_id)
+        tmp_path = f'{file_path}.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(pgcr, f, separators=(',', ':'))
+        os.replace(tmp_path, file_path)
+        return os.path.getsize(file_path)
+    
+    async def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        
+        # Oldest access first
+        doomed = []
+        for instance_id, (size, _) in sorted(self.files.items(), key=lambda item: item[1][1]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            doomed.append(instance_id)
+            self.total_bytes -= size
+        await self._delete(doomed, counted=True)
+    
+    async def _delete(self, instance_ids, counted=False):
+        for instance_id in instance_ids:
+            size, _ = self.files.pop(instance_id, (0, 0))
+            if not counted:
+                self.total_bytes -= size
+            self.memory.pop(instance_id, None)
+        await run_in_cache_thread(self._remove_files, instance_ids)
+    
+    def _remove_files(self, instance_ids):
+        for instance_id in instance_ids:
+            try:
+                os.remove(self._file_path(instance_id))
+            except OSError:
+                pass
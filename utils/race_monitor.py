@@ -1,13 +1,43 @@
 # utils/race_monitor.py
 import discord
-import json
 import os
+import asyncio
+import hashlib
+import time
+import traceback
 from datetime import datetime
 import pytz
-import aiohttp
+from utils.bungie_api import BungieAPIError, BungieUnavailable
+from utils.validation_cache import ValidationCache
+from utils.file_cache import run_in_cache_thread
+from utils.history_planner import HistoryPlanner
+from utils.rate_limiter import set_flow, set_priority, INTERACTIVE
+from utils.checkpoint import RaceCheckpoint
+from utils.state_store import get_store
 
 PURPLE = 0x9B59B6
 
+# Max number of teams checked at once per race (1 = one team at a time)
+MONITOR_CONCURRENCY = max(1, int(os.getenv('MONITOR_CONCURRENCY', '5')))
+
+_validation_cache = None
+
+# (guild_id, race_id) -> future of the check running for that race, so others can join it
+_race_checks = {}
+
+async def get_validation_cache(cache_dir='./Cache'):
+    """Shared validate_completion memo (loaded from the Bungie client's cache directory on first use)"""
+    global _validation_cache
+    if _validation_cache is None:
+        cache = await run_in_cache_thread(ValidationCache, os.path.join(cache_dir, 'validations.json'))
+        if _validation_cache is None:  # (another check may have loaded it while we waited)
+            _validation_cache = cache
+    return _validation_cache
+
+def roster_fingerprint(team_members):
+    """Short stable hash of a team's member list (order doesn't matter)"""
+    return hashlib.sha1('\n'.join(sorted(team_members)).encode('utf-8')).hexdigest()[:12]
+
 def format_time(seconds):
     """Format seconds into readable time string"""
     if seconds is None:
@@ -24,53 +54,50 @@ def format_time(seconds):
     else:
         return f"{secs}s"
 
-async def check_race_completions(bot, guild):
-    """Check for new dungeon completions and update leaderboards"""
+async def check_race_completions(bot, guild, planner=None, race_ids=None, scheduler=None, final=False):
+    """
+    Check for new dungeon completions and update leaderboards
+    `planner` holds histories prefetched for the whole cycle (see plan_history_fetches)
+    `race_ids` limits the check to those races, and `scheduler` (a RaceScheduler) picks
+    which of their teams are due and gets told when each race/team should be checked next
+    `final` is the last sweep of races that just ended (see finalize_race)
+    Returns {race_id: {team_name: new runs}} for the races checked (see check_race)
+    """
+    summary = {}
+    
+    # Bill this guild's Bungie requests to its own fair-share flow
+    set_flow(guild.id)
     
     print(f"\n{'='*70}")
     print(f"🔍 RACE MONITOR CHECK - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"Guild: {guild.name} (ID: {guild.id})")
     print(f"{'='*70}")
     
-    events_file = f'./RaceEvents/{guild.id}.json'
-    teams_file = f'./Teams/{guild.id}.json'
-    
-    # Check if files exist
-    if not os.path.exists(events_file):
-        print(f"⚠️  No race events file found: {events_file}")
-        return
-    
-    if not os.path.exists(teams_file):
-        print(f"⚠️  No teams file found: {teams_file}")
-        return
-    
-    print(f"✓ Found race events file")
-    print(f"✓ Found teams file")
-    
-    with open(events_file, 'r') as f:
-        events = json.load(f)
-    
-    with open(teams_file, 'r') as f:
-        teams = json.load(f)
+    store = get_store()
+    events = await store.load_events(guild.id)
+    teams = await store.load_teams(guild.id)
     
     print(f"✓ Loaded {len(events)} race event(s)")
     print(f"✓ Loaded {len(teams)} team(s)")
     
     if not events:
         print("⚠️  No race events to check")
-        return
+        return summary
     
     now = datetime.now(pytz.UTC)
     print(f"Current time: {now.strftime('%Y-%m-%d %H:%M:%S %Z')}")
     
-    bungie_api_key = os.getenv('BUNGIE_API_KEY')
-    if not bungie_api_key:
+    api = getattr(bot, 'bungie_api', None)
+    if not api or not api.api_key:
         print("❌ BUNGIE_API_KEY not found in environment!")
-        return
+        return summary
     
-    print(f"✓ Initialized Bungie API")
+    print(f"✓ Using shared Bungie API client")
     
     for race_id, race_data in events.items():
+        if race_ids is not None and race_id not in race_ids:
+            continue
+        
         print(f"\n{'-'*70}")
         print(f"📋 Checking race: {race_id}")
         
@@ -85,308 +112,717 @@ async def check_race_completions(bot, guild):
         # Skip if race hasn't started
         if now < start_date:
             print(f"   ⏸️  Race hasn't started yet")
+            if scheduler:
+                scheduler.race_checked(guild.id, race_id, race_data, now)
+            continue
+        
+        # Ended races are swept and finalized by their end timer (see finalize_race)
+        if now > end_date and not final:
+            print(f"   🏁 Race has ended - waiting for its final sweep")
+            if scheduler:
+                scheduler.forget(guild.id, race_id)
+            continue
+        
+        print(f"   ✓ Race is {'ENDED - final sweep' if final else 'ACTIVE'}")
+        
+        if scheduler:
+            scheduler.race_checked(guild.id, race_id, race_data, now)
+        
+        # Don't spend the cycle on requests that will fail - results stay as they were
+        if api.breaker.is_open:
+            print(f"   ⛔ Bungie API is unavailable - skipping completion checks until it recovers")
             continue
         
-        # Check if race has ended
-        if now > end_date:
-            print(f"   🏁 Race has ended - handling race end")
-            await handle_race_end(bot, guild, race_id, race_data, teams)
+        # Another check of this race is already running (scheduled tick, /refresh-race) - join it
+        race_key = (guild.id, race_id)
+        if race_key in _race_checks:
+            print(f"   ⏳ Race is already being checked - joining that check")
+            summary[race_id] = await asyncio.shield(_race_checks[race_key])
             continue
         
-        print(f"   ✓ Race is ACTIVE")
+        _race_checks[race_key] = asyncio.get_running_loop().create_future()
+        race_summary = {}
+        try:
+            race_summary = await check_race(bot, guild, race_id, race_data, teams, api, planner, scheduler, now)
+        finally:
+            _race_checks.pop(race_key).set_result(race_summary)
+        summary[race_id] = race_summary
+    
+    print(f"\n📈 Bungie limiter - {api.limiter.describe()}")
+    print(f"\n{'='*70}")
+    print(f"✅ Race monitor check complete")
+    print(f"{'='*70}\n")
+    
+    return summary
+
+async def check_race(bot, guild, race_id, race_data, teams, api, planner, scheduler, now):
+    """
+    Check every (due) team of one active race, save its results and update its leaderboard
+    Returns {team_name: {'valid': [(instance_id, seconds)], 'invalid': [(instance_id, reason)]}}
+    with only the runs that are new since the previous check
+    """
+    race_summary = {}
+    
+    # Race is active - check completions
+    store = get_store()
+    results = await store.load_results(guild.id, race_id, race_data)
+    if results:
+        print(f"   ✓ Loaded existing results ({len(results)} teams)")
+    else:
+        print(f"   ✓ No results yet for this race")
+    checked = {}  # team -> new result, saved once the check is done
+    
+    # Count teams for this race
+    race_team_items = [(t, d) for t, d in teams.items() if d.get('race_id') == race_id]
+    print(f"   ✓ Found {len(race_team_items)} team(s) in this race")
+    
+    # The previous check of this race was interrupted - pick up what it had already done
+    checkpoint = await RaceCheckpoint(store, guild.id, race_id, race_data).load()
+    resumed = [team_name for team_name in checkpoint.teams if team_name in teams]
+    for team_name in resumed:
+        results[team_name] = checkpoint.teams[team_name]['result']
+        checked[team_name] = results[team_name]
+        api.histories.restore(checkpoint.teams[team_name]['cursors'])
+    if resumed:
+        print(f"   ♻️  Resuming from checkpoint ({len(resumed)} team(s) already checked)")
+        race_team_items = [(t, d) for t, d in race_team_items if t not in checkpoint.teams]
+    
+    # Teams that keep coming up empty are checked less often
+    if scheduler:
+        due_team_items = [
+            (t, d) for t, d in race_team_items if scheduler.team_is_due(guild.id, race_id, t, now)
+        ]
+        if len(due_team_items) < len(race_team_items):
+            print(f"   💤 {len(race_team_items) - len(due_team_items)} quiet team(s) not due yet")
+        race_team_items = due_team_items
+    
+    # Check each team's completions concurrently (capped by MONITOR_CONCURRENCY)
+    validations = await get_validation_cache(api.cache_dir)
+    semaphore = asyncio.Semaphore(MONITOR_CONCURRENCY)
+    
+    async def run_team_check(team_name, team_data):
+        async with semaphore:
+            team_check = await check_team(
+                api, team_name, team_data, race_data, results.get(team_name, {}), validations, planner
+            )
+        
+        if team_check[0] is not None:
+            try:
+                await checkpoint.put_team(team_name, team_check[0], team_cursors(api, team_data))
+            except Exception as e:
+                print(f"   ⚠️  Could not write checkpoint for {team_name}: {e}")
+        return team_check
+    
+    team_checks = await asyncio.gather(*[
+        run_team_check(team_name, team_data) for team_name, team_data in race_team_items
+    ])
+    
+    # Merge in team order so the saved results and log output are deterministic
+    for (team_name, team_data), (team_result, team_log, changes) in zip(race_team_items, team_checks):
+        for line in team_log:
+            print(line)
+        if team_result is None:
+            continue
+        
+        results[team_name] = team_result
+        checked[team_name] = team_result
+        if changes['valid'] or changes['invalid']:
+            race_summary[team_name] = changes
+        
+        if scheduler:
+            scheduler.team_checked(guild.id, race_id, team_name, race_data, bool(changes['valid']), now)
+    
+    try:
+        await save_caches(validations, api.histories, api.identities)
+    except Exception as e:
+        print(f"   ⚠️  Could not save caches: {e}")
+    
+    # Save the teams that were checked (one transaction)
+    try:
+        await store.put_results(guild.id, race_id, race_data, checked)
+        print(f"\n   💾 Results saved ({len(checked)} team(s) checked)")
+        await checkpoint.clear()
+    except Exception as e:
+        print(f"\n   ❌ Error saving results: {e}")
+    
+    # Update leaderboard
+    try:
+        print(f"   📊 Updating leaderboard...")
+        await publish_leaderboard(bot, guild, race_id, race_data, results)
+        print(f"   ✓ Leaderboard updated")
+    except Exception as e:
+        print(f"   ❌ Error updating leaderboard: {e}")
+        import traceback
+        traceback.print_exc()
+    
+    return race_summary
+
+async def save_caches(*caches):
+    """Write changed caches to disk (on the cache thread, so a big JSON dump never stalls the event loop)"""
+    for cache in caches:
+        await cache.save()
+
+def team_cursors(api, team_data):
+    """The captain's history cursors (for a checkpoint)"""
+    members = team_data.get('members', [])
+    identity = api.identities.get(members[0]) if members else None
+    if not identity or identity.get('not_found'):
+        return {}
+    return api.histories.export(identity['membershipId'])
+
+async def finalize_race(bot, guild, race_id, scheduler=None):
+    """
+    Final completion sweep for a race that just ended, then post winners and lock channels
+    Returns False if it should be retried later (Bungie unavailable)
+    """
+    events = await get_store().load_events(guild.id)
+    
+    # Cancelled or already finalized
+    if race_id not in events:
+        return True
+    
+    api = getattr(bot, 'bungie_api', None)
+    if api and api.breaker.is_open:
+        print(f"⛔ Bungie API is unavailable - postponing the final sweep of {race_id}")
+        return False
+    
+    print(f"🏁 {race_id} has ended - running final completion sweep")
+    await check_race_completions(bot, guild, race_ids=[race_id], final=True)
+    
+    teams = await get_store().load_teams(guild.id, race_id)
+    await handle_race_end(bot, guild, race_id, events[race_id], teams)
+    if scheduler:
+        scheduler.forget(guild.id, race_id)
+    return True
+
+async def warm_up_race(bot, guild, race_id):
+    """
+    Resolve every registered member of a race that's about to start (membership and characters),
+    so the first in-race check doesn't spend its requests on name lookups
+    """
+    store = get_store()
+    events = await store.load_events(guild.id)
+    if race_id not in events:
+        return
+    teams = await store.load_teams(guild.id, race_id)
+    
+    api = getattr(bot, 'bungie_api', None)
+    if not api or not api.api_key or api.breaker.is_open:
+        print(f"⏭️  Skipping warm-up of {race_id} - Bungie API unavailable")
+        return
+    
+    set_flow(guild.id)
+    
+    players = {
+        member
+        for team_data in teams.values() if team_data.get('race_id') == race_id
+        for member in team_data.get('members', [])
+    }
+    
+    print(f"🔥 Warming up {race_id}: {len(players)} player(s)")
+    
+    semaphore = asyncio.Semaphore(MONITOR_CONCURRENCY)
+    
+    async def warm_player(bungie_name):
+        if '#' not in bungie_name:
+            return False
+        
+        async with semaphore:
+            try:
+                await api.resolve_player(bungie_name)
+                return True
+            except Exception as e:
+                print(f"   ⚠️  Could not warm up {bungie_name}: {e}")
+                return False
+    
+    warmed = await asyncio.gather(*[
+        warm_player(bungie_name) for bungie_name in players
+    ])
+    
+    try:
+        await save_caches(api.identities)
+    except Exception as e:
+        print(f"   ⚠️  Could not save caches: {e}")
+    
+    print(f"🔥 Warm-up of {race_id} done: {sum(warmed)}/{len(players)} player(s) ready")
+
+async def check_team(api, team_name, team_data, race_data, previous, validations, planner=None):
+    """
+    Check one team's completions against the Bungie API
+    Returns (new result or None on error, log lines, new runs) so concurrent checks can be printed
+    in order. New runs are {'valid': [(instance_id, seconds)], 'invalid': [(instance_id, reason)]}.
+    """
+    lines = []
+    log = lines.append
+    changes = {'valid': [], 'invalid': []}
+    
+    dungeon_hash = race_data['dungeon_hash']
+    race_type = race_data['race_type']
+    start_date = datetime.fromisoformat(race_data['start_date'])
+    end_date = datetime.fromisoformat(race_data['end_date'])
+    
+    log(f"\n   🏃 Checking team: {team_name}")
+    
+    # Get team members
+    team_members = team_data.get('members', [])
+    if not team_members:
+        log(f"      ⚠️  No team members found")
+        return None, lines, changes
+    
+    log(f"      Team members: {', '.join(team_members)}")
+    
+    captain_name = team_members[0]
+    log(f"      Captain: {captain_name}")
+    
+    # Fetch recent activities from Bungie API
+    try:
+        log(f"      🔍 Fetching activities from Bungie API...")
+        completions = await get_completions(
+            api,
+            captain_name,
+            dungeon_hash,
+            start_date,
+            end_date,
+            planner
+        )
         
-        # Race is active - check completions
-        dungeon_hash = race_data['dungeon_hash']
-        race_type = race_data['race_type']
+        log(f"      ✓ Found {len(completions)} potential completion(s)")
         
-        # Load or create results file
-        results_file = f'./Results/{guild.id}/{race_id}_{end_date.strftime("%Y%m%d")}.json'
-        os.makedirs(os.path.dirname(results_file), exist_ok=True)
+        # Check if team composition has changed
+        stored_team_members = previous.get('team_members', [])
+        team_changed = sorted(team_members) != sorted(stored_team_members)
         
-        results = {}
-        if os.path.exists(results_file):
-            with open(results_file, 'r') as f:
-                results = json.load(f)
-            print(f"   ✓ Loaded existing results ({len(results)} teams)")
+        if team_changed and stored_team_members:
+            log(f"      ⚠️  Team composition changed!")
+            log(f"         Old: {stored_team_members}")
+            log(f"         New: {team_members}")
+            log(f"      🔄 Re-validating all previous completions...")
+            
+            # Need to re-validate ALL previously processed instances
+            # Clear processed instances so they get re-checked
+            processed_instances = []
         else:
-            print(f"   ✓ Creating new results file")
+            processed_instances = list(previous.get('processed_instances', []))
         
-        # Count teams for this race
-        race_teams = [t for t, d in teams.items() if d.get('race_id') == race_id]
-        print(f"   ✓ Found {len(race_teams)} team(s) in this race")
+        log(f"      Already processed: {len(processed_instances)} completion(s)")
         
-        # Check each team's completions
-        for team_name, team_data in teams.items():
-            if team_data.get('race_id') != race_id:
-                continue
+        # (a roster change empties processed_instances, but those runs still aren't new)
+        previously_processed = set(previous.get('processed_instances', []))
+        
+        # Runs already rejected for this exact roster don't need their PGCR again
+        roster = roster_fingerprint(team_members)
+        rejected_instances = {
+            instance_id: rejection
+            for instance_id, rejection in previous.get('rejected_instances', {}).items()
+            if rejection.get('roster') == roster
+        }
+        skipped_rejected = 0
+        
+        # Process and validate activities
+        valid_times = []
+        
+        new_completions = 0
+        revalidated = 0
+        invalidated = 0
+        
+        for completion in completions:
+            instance_id = completion['instance_id']
             
-            print(f"\n   🏃 Checking team: {team_name}")
+            # If team changed, re-validate everything
+            # Otherwise, skip already processed instances
+            if not team_changed and instance_id in processed_instances:
+                continue
             
-            # Get team members
-            team_members = team_data.get('members', [])
-            if not team_members:
-                print(f"      ⚠️  No team members found")
+            if instance_id in rejected_instances:
+                skipped_rejected += 1
                 continue
             
-            print(f"      Team members: {', '.join(team_members)}")
+            was_processed = instance_id in previously_processed
             
-            captain_name = team_members[0]
-            print(f"      Captain: {captain_name}")
+            log(f"      🔍 {'Re-validating' if was_processed else 'Validating new'} completion: {instance_id}")
             
-            # Fetch recent activities from Bungie API
-            try:
-                print(f"      🔍 Fetching activities from Bungie API...")
-                completions = await get_completions(
-                    bungie_api_key,
-                    captain_name,
-                    dungeon_hash,
-                    start_date,
-                    end_date
-                )
-                
-                print(f"      ✓ Found {len(completions)} potential completion(s)")
-                
-                # Check if team composition has changed
-                stored_team_members = results.get(team_name, {}).get('team_members', [])
-                team_changed = sorted(team_members) != sorted(stored_team_members)
-                
-                if team_changed and stored_team_members:
-                    print(f"      ⚠️  Team composition changed!")
-                    print(f"         Old: {stored_team_members}")
-                    print(f"         New: {team_members}")
-                    print(f"      🔄 Re-validating all previous completions...")
-                    
-                    # Need to re-validate ALL previously processed instances
-                    # Clear processed instances so they get re-checked
-                    processed_instances = []
-                else:
-                    processed_instances = results.get(team_name, {}).get('processed_instances', [])
-                
-                print(f"      Already processed: {len(processed_instances)} completion(s)")
-                
-                # Process and validate activities
-                valid_times = []
-                
-                new_completions = 0
-                revalidated = 0
-                invalidated = 0
-                
-                for completion in completions:
-                    instance_id = completion['instance_id']
-                    
-                    # If team changed, re-validate everything
-                    # Otherwise, skip already processed instances
-                    if not team_changed and instance_id in processed_instances:
-                        continue
-                    
-                    was_processed = instance_id in processed_instances
-                    
-                    print(f"      🔍 {'Re-validating' if was_processed else 'Validating new'} completion: {instance_id}")
-                    
-                    # Fetch PGCR and validate
-                    pgcr = await get_pgcr(bungie_api_key, instance_id)
-                    is_valid, reason = validate_completion(pgcr, team_members)
-                    
-                    if is_valid:
-                        completion_time = completion['duration']
-                        valid_times.append(completion_time)
-                        processed_instances.append(instance_id)
-                        if was_processed:
-                            revalidated += 1
-                            print(f"         ✓ STILL VALID - Time: {format_time(completion_time)}")
-                        else:
-                            new_completions += 1
-                            print(f"         ✓ VALID - Time: {format_time(completion_time)}")
-                    else:
-                        if was_processed:
-                            invalidated += 1
-                            print(f"         ✗ NOW INVALID: {reason}")
-                        else:
-                            print(f"         ✗ Invalid: {reason}")
-                
-                if team_changed:
-                    print(f"      Re-validation complete: {revalidated} still valid, {invalidated} invalidated")
-                
-                if new_completions > 0:
-                    print(f"      ✓ Added {new_completions} new valid completion(s)")
-                elif not team_changed:
-                    print(f"      No new completions found")
-                
-                # All times are now in valid_times (only new/revalidated times from this check)
-                # We need to combine with existing times ONLY if team hasn't changed
-                if team_changed:
-                    # Team changed - only use newly validated times
-                    all_valid_times = valid_times
+            # Reuse the verdict for this run and roster if we've seen it before,
+            # otherwise fetch the PGCR and validate
+            verdict = validations.get(instance_id, roster)
+            if verdict:
+                is_valid, reason = verdict
+                definitive = True
+            else:
+                pgcr = await get_pgcr(api, instance_id)
+                is_valid, reason = validate_completion(pgcr, team_members)
+                definitive = pgcr is not None
+                if definitive:
+                    validations.put(instance_id, roster, is_valid, reason)
+            
+            if is_valid:
+                completion_time = completion['duration']
+                valid_times.append(completion_time)
+                processed_instances.append(instance_id)
+                if was_processed:
+                    revalidated += 1
+                    log(f"         ✓ STILL VALID - Time: {format_time(completion_time)}")
                 else:
-                    # Team unchanged - get existing valid times and add new ones
-                    existing_times = results.get(team_name, {}).get('all_times', [])
-                    # Combine existing and new times, remove duplicates by converting to set and back
-                    all_valid_times = existing_times + valid_times
-                
-                all_valid_times.sort()  # Sort all times (best first)
-                
-                # Calculate result based on race type
-                if race_type == 'best':
-                    result_time = all_valid_times[0] if all_valid_times else None
-                else:  # average
-                    if len(all_valid_times) >= 3:
-                        result_time = sum(all_valid_times[:3]) / 3
-                    elif all_valid_times:
-                        result_time = sum(all_valid_times) / len(all_valid_times)
-                    else:
-                        result_time = None
+                    new_completions += 1
+                    changes['valid'].append((instance_id, completion_time))
+                    log(f"         ✓ VALID - Time: {format_time(completion_time)}")
+            else:
+                # Remember the rejection unless the PGCR just couldn't be fetched
+                if definitive:
+                    rejected_instances[instance_id] = {'reason': reason, 'roster': roster}
+                    changes['invalid'].append((instance_id, reason))
                 
-                # Store result with current team composition
-                results[team_name] = {
-                    'time': result_time,
-                    'completions': len(all_valid_times),
-                    'all_times': all_valid_times[:10],  # Keep top 10
-                    'processed_instances': processed_instances,
-                    'team_members': team_members  # Track team composition
-                }
-                
-                if result_time:
-                    print(f"      📊 Current result: {format_time(result_time)} ({len(all_valid_times)} completions)")
+                if was_processed:
+                    invalidated += 1
+                    log(f"         ✗ NOW INVALID: {reason}")
                 else:
-                    print(f"      📊 No valid completions yet")
-                
-            except Exception as e:
-                print(f"      ❌ Error checking completions: {e}")
-                import traceback
-                traceback.print_exc()
-                continue
+                    log(f"         ✗ Invalid: {reason}")
         
-        # Save results
-        try:
-            with open(results_file, 'w') as f:
-                json.dump(results, f, indent=2)
-            print(f"\n   💾 Results saved to: {results_file}")
-        except Exception as e:
-            print(f"\n   ❌ Error saving results: {e}")
+        if skipped_rejected:
+            log(f"      Skipped {skipped_rejected} run(s) already rejected for this roster")
         
-        # Update leaderboard
-        try:
-            print(f"   📊 Updating leaderboard...")
-            await update_leaderboard(bot, guild, race_id, race_data, results)
-            print(f"   ✓ Leaderboard updated")
-        except Exception as e:
-            print(f"   ❌ Error updating leaderboard: {e}")
-            import traceback
-            traceback.print_exc()
+        if team_changed:
+            log(f"      Re-validation complete: {revalidated} still valid, {invalidated} invalidated")
+        
+        if new_completions > 0:
+            log(f"      ✓ Added {new_completions} new valid completion(s)")
+        elif not team_changed:
+            log(f"      No new completions found")
+        
+        # All times are now in valid_times (only new/revalidated times from this check)
+        # We need to combine with existing times ONLY if team hasn't changed
+        if team_changed:
+            # Team changed - only use newly validated times
+            all_valid_times = valid_times
+        else:
+            # Team unchanged - get existing valid times and add new ones
+            existing_times = previous.get('all_times', [])
+            # Combine existing and new times, remove duplicates by converting to set and back
+            all_valid_times = existing_times + valid_times
+        
+        all_valid_times.sort()  # Sort all times (best first)
+        
+        # Calculate result based on race type
+        if race_type == 'best':
+            result_time = all_valid_times[0] if all_valid_times else None
+        else:  # average
+            if len(all_valid_times) >= 3:
+                result_time = sum(all_valid_times[:3]) / 3
+            elif all_valid_times:
+                result_time = sum(all_valid_times) / len(all_valid_times)
+            else:
+                result_time = None
+        
+        # Store result with current team composition
+        result = {
+            'time': result_time,
+            'completions': len(all_valid_times),
+            'all_times': all_valid_times[:10],  # Keep top 10
+            'processed_instances': processed_instances,
+            'rejected_instances': rejected_instances,  # instance_id -> {reason, roster}
+            'team_members': team_members  # Track team composition
+        }
+        
+        if result_time:
+            log(f"      📊 Current result: {format_time(result_time)} ({len(all_valid_times)} completions)")
+        else:
+            log(f"      📊 No valid completions yet")
     
-    print(f"\n{'='*70}")
-    print(f"✅ Race monitor check complete")
-    print(f"{'='*70}\n")
+    except BungieUnavailable as e:
+        log(f"      ⛔ Skipped - {e}")
+        return None, lines, changes
+    except Exception as e:
+        log(f"      ❌ Error checking completions: {e}")
+        log(traceback.format_exc().rstrip())
+        return None, lines, changes
+    
+    return result, lines, changes
 
-async def get_completions(api_key, bungie_name, dungeon_hash, start_date, end_date):
+async def get_completions(api, bungie_name, dungeon_hash, start_date, end_date, planner=None):
     """Get all completions for a player in a date range"""
-    headers = {"X-API-Key": api_key}
+    # Use the history already fetched for this cycle if the planner has it
+    history = await planner.history_for(bungie_name, start_date) if planner else None
+    if history is None:
+        history = await get_player_history(api, bungie_name, start_date)
+    
+    completions = parse_completions(history, dungeon_hash, start_date, end_date)
     
+    # Oldest first
+    completions.sort(key=lambda c: c['date'])
+    
+    return completions
+
+async def get_player_history(api, bungie_name, since):
+    """Get a player's dungeon history (all characters, newest first) back to a date"""
     # Search for player
     if '#' not in bungie_name:
         return []
     
-    name, code = bungie_name.split('#')
+    try:
+        # Membership and characters come from the identity cache when warm
+        membership_type, membership_id, characters = await api.resolve_player(bungie_name)
+    except BungieAPIError:
+        # Throttled or Bungie is down - don't report that as "no completions"
+        raise
+    except Exception:
+        return []
     
-    url = "https://www.bungie.net/Platform/Destiny2/SearchDestinyPlayerByBungieName/-1/"
-    payload = {
-        "displayName": name,
-        "displayNameCode": int(code)
-    }
+    # Request every character's history at once; one failing character doesn't drop the others.
+    # Each character only pages back to its newest run from the last poll (or `since`).
+    histories = await asyncio.gather(*[
+        api.get_character_history(membership_type, membership_id, char_id, since)
+        for char_id in characters
+    ], return_exceptions=True)
+    
+    failures = [history for history in histories if isinstance(history, Exception)]
+    if characters and len(failures) == len(characters):
+        raise failures[0]
+    
+    all_activities = []
     
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers, json=payload) as response:
-            if response.status != 200:
-                return []
+    for char_id, activities in zip(characters, histories):
+        if isinstance(activities, Exception):
+            print(f"      ⚠️  Could not load history for character {char_id}: {activities}")
+            continue
+        
+        all_activities.extend(activities)
+    
+    # Merge the per-character streams into one time-ordered list (newest first)
+    all_activities.sort(key=lambda activity: activity['period'], reverse=True)
+    
+    return all_activities
+
+async def plan_history_fetches(bot, due=None, scheduler=None):
+    """
+    Collect the captains of every active race in every guild and start fetching each
+    player's history once for the whole cycle, however many races they're in
+    `due` ({guild_id: [race_id, ...]}) and `scheduler` limit this to the races and teams due now
+    """
+    planner = HistoryPlanner()
+    
+    api = getattr(bot, 'bungie_api', None)
+    if not api or not api.api_key or api.breaker.is_open:
+        return planner
+    
+    now = datetime.now(pytz.UTC)
+    
+    for guild in bot.guilds:
+        if due is not None and guild.id not in due:
+            continue
+        
+        try:
+            events = await get_store().load_events(guild.id)
+            teams = await get_store().load_teams(guild.id)
+        except Exception as e:
+            print(f"⚠️  Could not read race data for {guild.name}: {e}")
+            continue
+        
+        for race_id, race_data in events.items():
+            if due is not None and race_id not in due[guild.id]:
+                continue
+            
+            start_date = datetime.fromisoformat(race_data['start_date'])
+            end_date = datetime.fromisoformat(race_data['end_date'])
+            if not (start_date <= now <= end_date):
+                continue
             
-            data = await response.json()
-            if not data.get('Response'):
-                return []
+            # Teams an interrupted check already finished are resumed from its checkpoint, not fetched
+            checkpoint = await RaceCheckpoint(get_store(), guild.id, race_id, race_data).load()
+            already_checked = checkpoint.teams
             
-            player = data['Response'][0]
-            membership_type = player['membershipType']
-            membership_id = player['membershipId']
+            for team_name, team_data in teams.items():
+                if team_data.get('race_id') != race_id or not team_data.get('members'):
+                    continue
+                if team_name in already_checked:
+                    continue
+                if scheduler and not scheduler.team_is_due(guild.id, race_id, team_name, now):
+                    continue
+                planner.add(team_data['members'][0], race_data['dungeon_hash'], start_date, end_date, flow=guild.id)
+    
+    if planner.demands:
+        # Not awaited here: each race check waits only for the histories it needs
+        planner.start(
+            lambda bungie_name, since: get_player_history(api, bungie_name, since),
+            concurrency=MONITOR_CONCURRENCY
+        )
+    
+    return planner
+
+async def run_scheduled_checks(bot, scheduler):
+    """
+    One scheduler tick: pick up new/deleted races, then check only the races
+    (and teams) that are due. Returns {guild_id: check summary} for the guilds checked.
+    """
+    now = datetime.now(pytz.UTC)
     
-    # Get characters
-    url = f"https://www.bungie.net/Platform/Destiny2/{membership_type}/Profile/{membership_id}/?components=200"
+    api = getattr(bot, 'bungie_api', None)
+    if api:
+        scheduler.record_requests(sum(api.limiter.granted.values()), now)
     
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers=headers) as response:
-            if response.status != 200:
-                return []
-            
-            data = await response.json()
-            if 'Response' not in data or not data['Response']:
-                return []
+    presence_checks = []
+    for guild in bot.guilds:
+        try:
+            events = await get_store().load_events(guild.id)
+        except Exception as e:
+            print(f"⚠️  Could not read race events for {guild.name}: {e}")
+            continue
+        
+        scheduler.sync(guild.id, events, now)
+        presence_checks.append(check_presence(bot, guild, events, scheduler, now))
+    
+    # Cheap current-activity lookups decide which teams get polled often
+    await asyncio.gather(*presence_checks)
+    
+    due = scheduler.pop_due(now)
+    if not due:
+        return {}
+    
+    print(f"⏰ {sum(len(race_ids) for race_ids in due.values())} race(s) due for a check "
+          f"({scheduler.requests_last_hour()}/{scheduler.request_budget} requests in the last hour)")
+    
+    # Fetch each player's history once for every due race they're in, across all guilds
+    planner = await plan_history_fetches(bot, due, scheduler)
+    
+    # Guilds are checked concurrently; the rate limiter shares Bungie slots fairly between them
+    async def check_guild(guild):
+        started = time.monotonic()
+        try:
+            return await check_race_completions(bot, guild, planner, due[guild.id], scheduler)
+        finally:
+            latencies[guild.id] = time.monotonic() - started
             
-            characters_data = data.get('Response', {}).get('characters', {}).get('data', {})
-            characters = list(characters_data.keys())
+            # Races whose check bailed out early (missing files, no API key) retry later, not every tick
+            for race_id in due[guild.id]:
+                scheduler.ensure_scheduled(guild.id, race_id, now)
     
-    all_completions = []
+    latencies = {}
+    due_guilds = [guild for guild in bot.guilds if guild.id in due]
+    guild_summaries = await asyncio.gather(*[check_guild(guild) for guild in due_guilds], return_exceptions=True)
     
-    # Check each character
-    for char_id in characters:
-        url = (
-            f"https://www.bungie.net/Platform/Destiny2/{membership_type}/Account/{membership_id}/"
-            f"Character/{char_id}/Stats/Activities/?mode=82&count=50"
-        )
+    summaries = {}
+    for guild, guild_summary in zip(due_guilds, guild_summaries):
+        if isinstance(guild_summary, Exception):
+            print(f"❌ Error checking races for {guild.name}: {guild_summary}")
+            continue
+        summaries[guild.id] = guild_summary
+    
+    if api:
+        print("⏱️  Guild check latency:")
+        for guild in due_guilds:
+            flow_stats = api.limiter.flow_stats(guild.id)
+            print(f"   {guild.name}: {latencies.get(guild.id, 0.0):.1f}s, "
+                  f"{flow_stats['granted']} request(s) sent so far, avg limiter wait {flow_stats['avg_wait']:.2f}s")
+    
+    await planner.wait()
+    
+    next_due = scheduler.next_due()
+    if next_due is not None:
+        print(f"Next result check at {datetime.fromtimestamp(next_due, pytz.UTC).strftime('%Y-%m-%d %H:%M:%S %Z')}")
+    
+    return summaries
+
+async def check_presence(bot, guild, events, scheduler, now):
+    """
+    Look up which active-race captains are inside their race's dungeon right now
+    (one profile request each, on the scheduler's presence cadence)
+    """
+    api = getattr(bot, 'bungie_api', None)
+    if not api or not api.api_key or api.breaker.is_open:
+        return
+    
+    try:
+        teams = await get_store().load_teams(guild.id)
+    except Exception:
+        return
+    
+    set_flow(guild.id)
+    
+    lookups = []
+    for race_id, race_data in events.items():
+        start_date = datetime.fromisoformat(race_data['start_date'])
+        end_date = datetime.fromisoformat(race_data['end_date'])
+        if not (start_date <= now <= end_date):
+            continue
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                if response.status != 200:
-                    continue
-                
-                data = await response.json()
-                activities = data.get('Response', {}).get('activities', [])
-                
-                if not activities:
-                    continue
-                
-                for activity in activities:
-                    # Check if it's the right dungeon
-                    ref_id = activity.get('activityDetails', {}).get('referenceId')
-                    if ref_id != dungeon_hash:
-                        continue
-                    
-                    # Check date range
-                    period_str = activity.get('period')
-                    activity_date = datetime.fromisoformat(period_str.replace('Z', '+00:00'))
-                    
-                    # Early exit if past start date
-                    if activity_date < start_date:
-                        break
-                    
-                    if not (start_date <= activity_date <= end_date):
-                        continue
-                    
-                    # Check if completed
-                    completed = activity.get('values', {}).get('completed', {}).get('basic', {}).get('value', 0)
-                    if not completed or completed < 1:
-                        continue
-                    
-                    # Get completion time
-                    duration = activity.get('values', {}).get('activityDurationSeconds', {}).get('basic', {}).get('value', 0)
-                    instance_id = activity.get('activityDetails', {}).get('instanceId')
-                    
-                    all_completions.append({
-                        'instance_id': instance_id,
-                        'date': activity_date,
-                        'duration': duration
-                    })
-    
-    return all_completions
+        for team_name, team_data in teams.items():
+            members = team_data.get('members', [])
+            if team_data.get('race_id') != race_id or not members or '#' not in members[0]:
+                continue
+            if scheduler.presence_is_due(guild.id, race_id, team_name, now):
+                lookups.append((race_id, race_data, team_name, members[0]))
+    
+    if not lookups:
+        return
+    
+    semaphore = asyncio.Semaphore(MONITOR_CONCURRENCY)
+    
+    async def lookup(race_id, race_data, team_name, captain_name):
+        async with semaphore:
+            try:
+                membership_type, membership_id, _ = await api.resolve_player(captain_name)
+                current = await api.get_current_activities(membership_type, membership_id)
+            except Exception:
+                return  # leave the team on its normal cadence
+        
+        in_dungeon = race_data['dungeon_hash'] in current.values()
+        scheduler.team_presence(guild.id, race_id, team_name, in_dungeon, now)
+    
+    await asyncio.gather(*[lookup(*args) for args in lookups])
+
+async def refresh_race(bot, guild, race_id):
+    """
+    Check one race right now (every team), or join the check already running for it
+    Returns {team_name: new runs} (see check_race)
+    An admin is waiting on it, so its Bungie requests go ahead of the monitor's polling.
+    """
+    set_priority(INTERACTIVE)
+    
+    running = _race_checks.get((guild.id, race_id))
+    if running:
+        return await asyncio.shield(running)
+    
+    summary = await check_race_completions(bot, guild, race_ids=[race_id])
+    return summary.get(race_id, {})
 
-async def get_pgcr(api_key, instance_id):
+def parse_completions(activities, dungeon_hash, start_date, end_date):
+    """Pick the completed runs of a dungeon inside the race window from a history (newest first)"""
+    completions = []
+    
+    for activity in activities:
+        # Check if it's the right dungeon
+        if activity['reference_id'] != dungeon_hash:
+            continue
+        
+        # Check date range
+        activity_date = datetime.fromisoformat(activity['period'])
+        
+        # Early exit if past start date (history is newest first)
+        if activity_date < start_date:
+            break
+        
+        if not (start_date <= activity_date <= end_date):
+            continue
+        
+        # Check if completed
+        completed = activity['completed']
+        if not completed or completed < 1:
+            continue
+        
+        completions.append({
+            'instance_id': activity['instance_id'],
+            'date': activity_date,
+            'duration': activity['duration']
+        })
+    
+    return completions
+
+async def get_pgcr(api, instance_id):
     """Get Post Game Carnage Report for an activity"""
-    headers = {"X-API-Key": api_key}
-    url = f"https://www.bungie.net/Platform/Destiny2/Stats/PostGameCarnageReport/{instance_id}/"
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers=headers) as response:
-            if response.status == 200:
-                data = await response.json()
-                return data.get('Response')
-    return None
+    try:
+        return await api.get_pgcr(instance_id)
+    except BungieAPIError:
+        raise
+    except Exception:
+        return None
 
 def validate_completion(pgcr, team_members):
     """
@@ -459,6 +895,14 @@ def validate_completion(pgcr, team_members):
     
     return True, "Valid completion"
 
+async def publish_leaderboard(bot, guild, race_id, race_data, results):
+    """Update the leaderboard here, or hand it to the bot process when running in a monitor worker"""
+    publish = getattr(bot, 'publish', None)
+    if publish:
+        publish('leaderboard', guild.id, race_id, race_data, results)
+    else:
+        await update_leaderboard(bot, guild, race_id, race_data, results)
+
 async def update_leaderboard(bot, guild, race_id, race_data, results):
     """Update the leaderboard channel with current standings"""
     leaderboard_channel = discord.utils.get(guild.text_channels, name='leaderboard')
@@ -520,39 +964,53 @@ async def handle_race_end(bot, guild, race_id, race_data, teams):
     """Handle race end procedures"""
     print(f"   🏁 Handling race end for: {race_id}")
     
-    results_file = f'./Results/{guild.id}/{race_id}_{datetime.fromisoformat(race_data["end_date"]).strftime("%Y%m%d")}.json'
-    
-    if not os.path.exists(results_file):
-        print(f"   ⚠️  No results file found for ended race")
-        # Remove race from events even if no results
-        events_file = f'./RaceEvents/{guild.id}.json'
-        with open(events_file, 'r') as f:
-            events = json.load(f)
-        if race_id in events:
-            del events[race_id]
-            with open(events_file, 'w') as f:
-                json.dump(events, f, indent=2)
-            print(f"   ✓ Removed race from events file")
+    results = await close_race_results(guild.id, race_id, race_data, teams)
+    if results is None:
         return
     
-    with open(results_file, 'r') as f:
-        results = json.load(f)
+    # Discord side (winners, channel locks) - done by the bot process when running in a monitor worker
+    publish = getattr(bot, 'publish', None)
+    if publish:
+        publish('race_end', guild.id, race_id, race_data, results, teams)
+    else:
+        await announce_race_end(bot, guild, race_id, race_data, results, teams)
     
-    # Mark DNF for teams without enough completions
-    for team_name, team_data in teams.items():
-        if team_data.get('race_id') != race_id:
-            continue
+    print(f"   🏁 Race end handling complete")
+
+async def close_race_results(guild_id, race_id, race_data, teams):
+    """
+    File side of a race end: mark DNFs, save the final results and remove the race from the race events
+    Returns the final results, or None if the race never had any results
+    """
+    store = get_store()
+    results = await store.load_results(guild_id, race_id, race_data) or None
+    if results is None:
+        print(f"   ⚠️  No results found for ended race")
+    else:
+        # Mark DNF for teams without enough completions
+        final = {}
+        for team_name, team_data in teams.items():
+            if team_data.get('race_id') != race_id:
+                continue
+            
+            if team_name not in results or results[team_name]['time'] is None:
+                final[team_name] = {'time': None, 'completions': 0, 'status': 'DNF'}
+            elif race_data['race_type'] == 'average' and results[team_name]['completions'] < 3:
+                final[team_name] = {**results[team_name], 'status': 'DNF'}
         
-        if team_name not in results or results[team_name]['time'] is None:
-            results[team_name] = {'time': None, 'completions': 0, 'status': 'DNF'}
-        elif race_data['race_type'] == 'average' and results[team_name]['completions'] < 3:
-            results[team_name]['status'] = 'DNF'
+        # Save final results
+        await store.put_results(guild_id, race_id, race_data, final)
+        results.update(final)
+        print(f"   ✓ Saved final results")
     
-    # Save final results
-    with open(results_file, 'w') as f:
-        json.dump(results, f, indent=2)
-    print(f"   ✓ Saved final results")
+    # Remove race from the race events (race is complete)
+    await store.delete_race(guild_id, race_id)
+    print(f"   ✓ Removed race from race events")
     
+    return results
+
+async def announce_race_end(bot, guild, race_id, race_data, results, teams):
+    """Discord side of a race end: post winners and lock team channels"""
     # Post winners
     await post_winners(bot, guild, race_id, race_data, results)
     
@@ -574,19 +1032,6 @@ async def handle_race_end(bot, guild, race_id, race_data, teams):
             )
     
     print(f"   ✓ Locked team channels")
-    
-    # Remove race from events file (race is complete)
-    events_file = f'./RaceEvents/{guild.id}.json'
-    with open(events_file, 'r') as f:
-        events = json.load(f)
-    
-    if race_id in events:
-        del events[race_id]
-        with open(events_file, 'w') as f:
-            json.dump(events, f, indent=2)
-        print(f"   ✓ Removed race from events file")
-    
-    print(f"   🏁 Race end handling complete")
 
 async def post_winners(bot, guild, race_id, race_data, results):
     """Post winning teams to winners-circle"""
@@ -613,11 +1058,7 @@ async def post_winners(bot, guild, race_id, race_data, results):
         medal = medals[i] if i < 3 else ''
         time_str = format_time(result['time'])
         
-        teams_file = f'./Teams/{guild.id}.json'
-        with open(teams_file, 'r') as f:
-            teams = json.load(f)
-        
-        members = teams.get(team_name, {}).get('members', [])
+        members = (await get_store().get_team(guild.id, team_name) or {}).get('members', [])
         members_str = "\n".join([f"• {m}" for m in members])
         
         embed.add_field(
@@ -0,0 +1,199 @@
+# utils/race_scheduler.py
+import heapq
+import os
+from datetime import datetime, timedelta
+
+# How often an active race is checked, by how much time is left before it ends
+RACE_INTERVALS = [
+    (timedelta(hours=1), timedelta(minutes=5)),
+    (timedelta(hours=6), timedelta(minutes=15)),
+    (timedelta(hours=24), timedelta(minutes=30)),
+]
+DEFAULT_RACE_INTERVAL = timedelta(hours=1)
+
+# Teams with no new runs are checked less and less often, up to this
+TEAM_MAX_INTERVAL = timedelta(hours=2)
+
+# How often each team captain's current activity is looked up (0 = presence tracking off),
+# and how often a team seen inside the race dungeon has its history polled
+PRESENCE_INTERVAL = timedelta(minutes=int(os.getenv('PRESENCE_INTERVAL_MINUTES', '5')))
+HOT_TEAM_INTERVAL = timedelta(minutes=2)
+
+# Bungie requests the monitor may spend per hour before it starts stretching intervals
+MONITOR_REQUEST_BUDGET = int(os.getenv('MONITOR_REQUEST_BUDGET', '3000'))
+
+def race_interval(race_data, now):
+    """Base check interval for a race - shorter as its end approaches"""
+    end_date = datetime.fromisoformat(race_data['end_date'])
+    time_left = end_date - now
+    
+    for threshold, interval in RACE_INTERVALS:
+        if time_left <= threshold:
+            return interval
+    return DEFAULT_RACE_INTERVAL
+
+class RaceScheduler:
+    """
+    Priority queue of next-check times per race and per team
+    - races that haven't started sleep until their start_date
+    - active races are polled more often as the end approaches
+    - teams with no recent runs back off exponentially
+    - teams seen inside the race dungeon (presence) are polled every couple of minutes,
+      the rest stay on a slow cadence
+    - everything stretches when the monitor goes over its hourly request budget
+    """
+    def __init__(self, request_budget=MONITOR_REQUEST_BUDGET):
+        self.request_budget = request_budget
+        
+        self.heap = []  # (due timestamp, guild_id, race_id) - stale entries are skipped
+        self.race_due = {}  # (guild_id, race_id) -> due timestamp
+        self.team_due = {}  # (guild_id, race_id, team_name) -> due timestamp
+        self.team_idle = {}  # (guild_id, race_id, team_name) -> checks in a row without new runs
+        self.presence_due = {}  # (guild_id, race_id, team_name) -> next current-activity lookup
+        self.hot = {}  # (guild_id, race_id, team_name) -> captain was in the race dungeon at the last lookup
+        
+        self.request_samples = []  # (timestamp, total requests sent so far)
+    
+    def _schedule(self, guild_id, race_id, due):
+        self.race_due[(guild_id, race_id)] = due
+        heapq.heappush(self.heap, (due, guild_id, race_id))
+    
+    def sync(self, guild_id, events, now):
+        """Pick up new races and forget deleted ones for a guild"""
+        for race_id, race_data in events.items():
+            if (guild_id, race_id) in self.race_due:
+                continue
+            
+            # Ended races belong to their end timer (final sweep + finalization)
+            if datetime.fromisoformat(race_data['end_date']) < now:
+                continue
+            
+            # New race: first check at its start (or right away if it's already running/over)
+            start_date = datetime.fromisoformat(race_data['start_date'])
+            self._schedule(guild_id, race_id, max(start_date, now).timestamp())
+        
+        for key in [key for key in self.race_due if key[0] == guild_id and key[1] not in events]:
+            self.forget(*key)
+    
+    def forget(self, guild_id, race_id):
+        """Drop a race and its teams from the schedule"""
+        self.race_due.pop((guild_id, race_id), None)
+        for key in [key for key in self.team_due if key[:2] == (guild_id, race_id)]:
+            self.team_due.pop(key, None)
+            self.team_idle.pop(key, None)
+        for key in [key for key in self.presence_due if key[:2] == (guild_id, race_id)]:
+            self.presence_due.pop(key, None)
+            self.hot.pop(key, None)
+    
+    def pop_due(self, now):
+        """Return {guild_id: [race_id, ...]} for every race whose check is due"""
+        due = {}
+        timestamp = now.timestamp()
+        while self.heap and self.heap[0][0] <= timestamp:
+            due_at, guild_id, race_id = heapq.heappop(self.heap)
+            if self.race_due.get((guild_id, race_id)) != due_at:
+                continue  # rescheduled or removed since this entry was pushed
+            del self.race_due[(guild_id, race_id)]
+            due.setdefault(guild_id, []).append(race_id)
+        return due
+    
+    def race_checked(self, guild_id, race_id, race_data, now):
+        """Schedule the next check of a race after it has been checked"""
+        start_date = datetime.fromisoformat(race_data['start_date'])
+        if now < start_date:
+            self._schedule(guild_id, race_id, start_date.timestamp())
+            return
+        
+        end_date = datetime.fromisoformat(race_data['end_date'])
+        interval = race_interval(race_data, now) * self.budget_factor(now)
+        
+        # Always look again right when the race ends
+        next_check = min(now + interval, max(end_date, now))
+        self._schedule(guild_id, race_id, next_check.timestamp())
+    
+    def ensure_scheduled(self, guild_id, race_id, now):
+        """Put a due race back on the schedule if its check bailed out before rescheduling it"""
+        if (guild_id, race_id) not in self.race_due:
+            self._schedule(guild_id, race_id, (now + DEFAULT_RACE_INTERVAL).timestamp())
+    
+    def _wake_race(self, guild_id, race_id, due):
+        """Bring a race's next check forward (never back)"""
+        current = self.race_due.get((guild_id, race_id))
+        if current is not None and current > due:
+            self._schedule(guild_id, race_id, due)
+    
+    def team_is_due(self, guild_id, race_id, team_name, now):
+        due = self.team_due.get((guild_id, race_id, team_name))
+        return due is None or due <= now.timestamp()
+    
+    def team_checked(self, guild_id, race_id, team_name, race_data, found_new, now):
+        """Back off teams that keep coming up empty, reset the ones that found runs"""
+        key = (guild_id, race_id, team_name)
+        self.team_idle[key] = 0 if found_new else self.team_idle.get(key, 0) + 1
+        
+        base = race_interval(race_data, now)
+        if self.hot.get(key):
+            # In the dungeon right now - a run could land any minute
+            interval = HOT_TEAM_INTERVAL
+        elif key in self.hot:
+            # Presence will tell us when they go in, so the history can wait
+            interval = max(TEAM_MAX_INTERVAL, base) * self.budget_factor(now)
+        else:
+            interval = min(base * (2 ** self.team_idle[key]), max(TEAM_MAX_INTERVAL, base))
+            interval *= self.budget_factor(now)
+        
+        # Never back off past the end of the race
+        end_date = datetime.fromisoformat(race_data['end_date'])
+        next_check = min(now + interval, max(end_date, now))
+        
+        # Checked together with its race, so due a little early rather than a cycle late
+        self.team_due[key] = next_check.timestamp() - 60
+        self._wake_race(guild_id, race_id, next_check.timestamp())
+    
+    def presence_is_due(self, guild_id, race_id, team_name, now):
+        if PRESENCE_INTERVAL <= timedelta(0):
+            return False
+        due = self.presence_due.get((guild_id, race_id, team_name))
+        return due is None or due <= now.timestamp()
+    
+    def team_presence(self, guild_id, race_id, team_name, in_dungeon, now):
+        """Record whether a team's captain is inside the race dungeon right now"""
+        key = (guild_id, race_id, team_name)
+        was_hot = self.hot.get(key, False)
+        self.hot[key] = in_dungeon
+        self.presence_due[key] = (now + PRESENCE_INTERVAL * self.budget_factor(now)).timestamp() - 30
+        
+        if in_dungeon and not was_hot:
+            # Just went in - start polling often
+            due = (now + HOT_TEAM_INTERVAL).timestamp()
+            print(f"🔥 {team_name} is in the dungeon - checking every {HOT_TEAM_INTERVAL.seconds // 60} minutes")
+        elif was_hot and not in_dungeon:
+            # Just came out - the run they finished should be in their history now
+            due = now.timestamp()
+            print(f"🚪 {team_name} left the dungeon - checking for a new run")
+        else:
+            return
+        
+        self.team_due[key] = min(self.team_due.get(key, due), due)
+        self._wake_race(guild_id, race_id, due)
+    
+    def record_requests(self, total_requests, now):
+        """Remember how many Bungie requests have been sent so far (for the hourly budget)"""
+        timestamp = now.timestamp()
+        self.request_samples.append((timestamp, total_requests))
+        self.request_samples = [sample for sample in self.request_samples if sample[0] >= timestamp - 3600]
+    
+    def requests_last_hour(self):
+        if len(self.request_samples) < 2:
+            return 0
+        return self.request_samples[-1][1] - self.request_samples[0][1]
+    
+    def budget_factor(self, now):
+        """1.0 while under budget, otherwise how far over it we are (intervals are stretched by this)"""
+        if self.request_budget <= 0:
+            return 1.0
+        return max(1.0, self.requests_last_hour() / self.request_budget)
+    
+    def next_due(self):
+        """Earliest scheduled race check as a timestamp, or None"""
+        return min(self.race_due.values(), default=None)
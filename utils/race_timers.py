@@ -0,0 +1,135 @@
+# utils/race_timers.py
+import asyncio
+import heapq
+import os
+import time
+from datetime import datetime
+from utils.state_store import get_store
+
+# Wait this long after end_date before the final sweep, so late PGCRs have shown up
+RACE_END_GRACE_SECONDS = int(os.getenv('RACE_END_GRACE_SECONDS', '120'))
+
+# Warm up the identity cache (memberships, characters) this long before a race starts
+RACE_WARMUP_MINUTES = int(os.getenv('RACE_WARMUP_MINUTES', '15'))
+
+# How long to wait before trying to finalize again when the final sweep couldn't run
+FINALIZE_RETRY_SECONDS = 300
+
+class RaceTimers:
+    """
+    Timer heap that fires race start/end at the exact instant
+    on_warmup(guild_id, race_id) runs a few minutes before start_date, on_start(guild_id, race_id)
+    at start_date, on_end(guild_id, race_id) at end_date + grace. on_end returns False to be
+    retried a few minutes later.
+    """
+    def __init__(self, on_start, on_end, on_warmup=None, grace_seconds=RACE_END_GRACE_SECONDS,
+                 warmup_minutes=RACE_WARMUP_MINUTES):
+        self.on_start = on_start
+        self.on_end = on_end
+        self.on_warmup = on_warmup
+        self.grace_seconds = grace_seconds
+        self.warmup_seconds = warmup_minutes * 60
+        
+        self.heap = []  # (fire timestamp, kind, guild_id, race_id) - stale entries are skipped
+        self.timers = {}  # (kind, guild_id, race_id) -> fire timestamp
+        self.running = set()  # callbacks in progress
+        
+        self._wakeup = asyncio.Event()
+        self._task = None
+    
+    def add(self, kind, guild_id, race_id, fire_at):
+        """Set (or move) a timer; fire_at is a timestamp"""
+        self.timers[(kind, guild_id, race_id)] = fire_at
+        heapq.heappush(self.heap, (fire_at, kind, guild_id, race_id))
+        self._wakeup.set()
+    
+    def schedule_race(self, guild_id, race_id, race_data):
+        """Register the start and end timers of a race"""
+        start_date = datetime.fromisoformat(race_data['start_date'])
+        end_date = datetime.fromisoformat(race_data['end_date'])
+        
+        if start_date.timestamp() > time.time():
+            # Fires straight away if we're already inside the warm-up window (restart, late race creation)
+            if self.on_warmup and self.warmup_seconds > 0:
+                self.add('warmup', guild_id, race_id, start_date.timestamp() - self.warmup_seconds)
+            self.add('start', guild_id, race_id, start_date.timestamp())
+        self.add('end', guild_id, race_id, end_date.timestamp() + self.grace_seconds)
+    
+    def cancel_race(self, guild_id, race_id):
+        """Drop a race's timers (cancelled race)"""
+        for kind in ('warmup', 'start', 'end'):
+            self.timers.pop((kind, guild_id, race_id), None)
+    
+    async def rebuild(self, guild_filter=None):
+        """
+        Recreate every race's timers from the state store (after a restart)
+        `guild_filter(guild_id)` limits this to some guilds (a monitor worker's shard)
+        """
+        try:
+            all_events = await get_store().load_all_events()
+        except Exception as e:
+            print(f"⚠️  Could not load race timers: {e}")
+            return
+        
+        count = 0
+        for guild_id, events in all_events.items():
+            if guild_filter and not guild_filter(guild_id):
+                continue
+            for race_id, race_data in events.items():
+                self.schedule_race(guild_id, race_id, race_data)
+                count += 1
+        
+        print(f"⏱️  Scheduled start/end timers for {count} race(s)")
+    
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+    
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+    
+    def _pop_due(self):
+        due = []
+        now = time.time()
+        while self.heap and self.heap[0][0] <= now:
+            fire_at, kind, guild_id, race_id = heapq.heappop(self.heap)
+            if self.timers.get((kind, guild_id, race_id)) != fire_at:
+                continue  # moved or cancelled
+            del self.timers[(kind, guild_id, race_id)]
+            due.append((kind, guild_id, race_id))
+        return due
+    
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            
+            for kind, guild_id, race_id in self._pop_due():
+                # Run callbacks as their own tasks so a slow finalization doesn't delay other timers
+                task = asyncio.create_task(self._fire(kind, guild_id, race_id))
+                self.running.add(task)
+                task.add_done_callback(self.running.discard)
+            
+            delay = self.heap[0][0] - time.time() if self.heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def _fire(self, kind, guild_id, race_id):
+        try:
+            if kind == 'warmup':
+                await self.on_warmup(guild_id, race_id)
+                return
+            
+            if kind == 'start':
+                await self.on_start(guild_id, race_id)
+                return
+            
+            if await self.on_end(guild_id, race_id) is False:
+                print(f"⏱️  Could not finalize {race_id} yet - retrying in {FINALIZE_RETRY_SECONDS // 60} minutes")
+                self.add('end', guild_id, race_id, time.time() + FINALIZE_RETRY_SECONDS)
+        except Exception as e:
+            print(f"❌ Error in {kind} timer for {race_id}: {e}")
+            import traceback
+            traceback.print_exc()
@@ -0,0 +1,177 @@
+# utils/rate_limiter.py
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import time
+
+# Priority lanes (lower number goes first)
+INTERACTIVE = 0  # lookups made while a user waits on a command or button
+BACKGROUND = 1  # race monitor polling
+
+LANE_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+# Requests per second allowed towards Bungie, and how many can be sent in a burst
+BUNGIE_RATE_LIMIT = float(os.getenv('BUNGIE_RATE_LIMIT', '20'))
+BUNGIE_BURST = int(os.getenv('BUNGIE_BURST', '20'))
+
+# Who a request is made for (a guild ID while checking that guild's races). Each flow gets
+# its fair share of its lane, so one busy server can't starve the others.
+current_flow = contextvars.ContextVar('bungie_flow', default=None)
+
+def set_flow(flow):
+    """Tag the Bungie requests made from the current task (and tasks it starts) with a flow"""
+    current_flow.set(flow)
+
+# Lane for requests that don't ask for one (INTERACTIVE while a user waits on the result)
+current_priority = contextvars.ContextVar('bungie_priority', default=BACKGROUND)
+
+def set_priority(priority):
+    """Send the Bungie requests made from the current task (and tasks it starts) in a lane"""
+    current_priority.set(priority)
+
+class RateLimiter:
+    """
+    Token bucket in front of all Bungie traffic
+    Waiting requests are served by priority lane, and the whole bucket can be paused
+    when Bungie asks us to back off (ThrottleSeconds / HTTP 429).
+    Inside a lane, flows (guilds) are served by weighted fair queuing: every flow with
+    requests waiting gets a share of the slots proportional to its weight (default 1).
+    """
+    def __init__(self, rate=BUNGIE_RATE_LIMIT, burst=BUNGIE_BURST):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        
+        # Per lane: heap of (virtual finish tag, seq, future, queued_at, flow)
+        self.lanes = {lane: [] for lane in LANE_NAMES}
+        self.virtual_time = {lane: 0.0 for lane in LANE_NAMES}
+        self.last_finish = {lane: {} for lane in LANE_NAMES}  # flow -> finish tag of its last request
+        self.weights = {}  # flow -> weight
+        self._seq = itertools.count()
+        self._dispatcher = None
+        
+        # Wait time bookkeeping per lane
+        self.waited = {lane: 0.0 for lane in LANE_NAMES}
+        self.granted = {lane: 0 for lane in LANE_NAMES}
+        self.max_wait = {lane: 0.0 for lane in LANE_NAMES}
+        self.flow_waited = {}
+        self.flow_granted = {}
+    
+    def set_weight(self, flow, weight):
+        """Give a flow a bigger (or smaller) share of its lane"""
+        self.weights[flow] = max(weight, 0.01)
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    async def acquire(self, priority=BACKGROUND):
+        """Wait for a request slot in the given lane"""
+        lane = priority if priority in self.lanes else BACKGROUND
+        flow = current_flow.get()
+        future = asyncio.get_running_loop().create_future()
+        
+        # Finish tag: after this flow's previous request, but never behind the lane's clock
+        finish_tags = self.last_finish[lane]
+        start_tag = max(self.virtual_time[lane], finish_tags.get(flow, 0.0))
+        finish_tags[flow] = start_tag + 1.0 / self.weights.get(flow, 1.0)
+        
+        heapq.heappush(self.lanes[lane], (finish_tags[flow], next(self._seq), future, time.monotonic(), flow))
+        
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        
+        await future
+    
+    def pause(self, seconds):
+        """Stop handing out slots for a while (Bungie told us to back off)"""
+        if seconds <= 0:
+            return
+        
+        until = time.monotonic() + seconds
+        if until > self.paused_until:
+            self.paused_until = until
+            print(f"⏳ Bungie asked us to back off - pausing requests for {seconds:.1f}s")
+    
+    def _next_waiter(self):
+        for lane in sorted(self.lanes):
+            queue = self.lanes[lane]
+            while queue:
+                finish_tag, _, future, queued_at, flow = heapq.heappop(queue)
+                if not future.done():  # skip callers that gave up
+                    self.virtual_time[lane] = finish_tag
+                    if not queue:
+                        self.last_finish[lane].clear()  # lane idle - every flow starts even again
+                    return lane, future, queued_at, flow
+        return None
+    
+    async def _dispatch(self):
+        while any(self.lanes.values()):
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                continue
+            
+            waiter = self._next_waiter()
+            if waiter is None:
+                break
+            
+            lane, future, queued_at, flow = waiter
+            self.tokens -= 1
+            
+            waited = time.monotonic() - queued_at
+            self.waited[lane] += waited
+            self.granted[lane] += 1
+            self.max_wait[lane] = max(self.max_wait[lane], waited)
+            self.flow_waited[flow] = self.flow_waited.get(flow, 0.0) + waited
+            self.flow_granted[flow] = self.flow_granted.get(flow, 0) + 1
+            
+            future.set_result(None)
+    
+    def queue_depth(self):
+        """Number of requests waiting per lane"""
+        return {
+            LANE_NAMES[lane]: sum(1 for entry in queue if not entry[2].done())
+            for lane, queue in self.lanes.items()
+        }
+    
+    def stats(self):
+        """Queue depth and wait times per lane"""
+        depth = self.queue_depth()
+        return {
+            LANE_NAMES[lane]: {
+                'queued': depth[LANE_NAMES[lane]],
+                'granted': self.granted[lane],
+                'avg_wait': self.waited[lane] / self.granted[lane] if self.granted[lane] else 0.0,
+                'max_wait': self.max_wait[lane]
+            }
+            for lane in self.lanes
+        }
+    
+    def flow_stats(self, flow):
+        """Requests sent and average limiter wait for one flow"""
+        granted = self.flow_granted.get(flow, 0)
+        return {
+            'granted': granted,
+            'avg_wait': self.flow_waited.get(flow, 0.0) / granted if granted else 0.0
+        }
+    
+    def describe(self):
+        """One-line summary for logs"""
+        parts = []
+        for lane, lane_stats in self.stats().items():
+            parts.append(
+                f"{lane}: {lane_stats['queued']} queued, {lane_stats['granted']} sent, "
+                f"avg wait {lane_stats['avg_wait']:.2f}s (max {lane_stats['max_wait']:.2f}s)"
+            )
+        return " | ".join(parts)
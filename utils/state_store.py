@@ -0,0 +1,478 @@
+# utils/state_store.py
+import asyncio
+import glob
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+# SQLite database with every guild's races, teams and results
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', './dungeon_race.db')
+
+# Bumped when the schema changes (stored in PRAGMA user_version)
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS races (
+    guild_id INTEGER NOT NULL,
+    race_id TEXT NOT NULL,
+    dungeon_name TEXT,
+    dungeon_hash INTEGER,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    timezone TEXT,
+    race_type TEXT,
+    PRIMARY KEY (guild_id, race_id)
+);
+
+CREATE TABLE IF NOT EXISTS teams (
+    guild_id INTEGER NOT NULL,
+    team_name TEXT NOT NULL,
+    race_id TEXT,
+    captain TEXT,
+    captain_id INTEGER,
+    text_channel_id INTEGER,
+    voice_channel_id INTEGER,
+    message_id INTEGER,
+    PRIMARY KEY (guild_id, team_name)
+);
+CREATE INDEX IF NOT EXISTS teams_by_race ON teams (guild_id, race_id);
+
+CREATE TABLE IF NOT EXISTS members (
+    guild_id INTEGER NOT NULL,
+    team_name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    member TEXT NOT NULL,
+    PRIMARY KEY (guild_id, team_name, position),
+    FOREIGN KEY (guild_id, team_name) REFERENCES teams (guild_id, team_name)
+        ON UPDATE CASCADE ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS members_by_member ON members (guild_id, member);
+
+CREATE TABLE IF NOT EXISTS results (
+    guild_id INTEGER NOT NULL,
+    race_id TEXT NOT NULL,
+    race_date TEXT NOT NULL,
+    team_name TEXT NOT NULL,
+    time REAL,
+    completions INTEGER NOT NULL DEFAULT 0,
+    status TEXT,
+    team_members TEXT,
+    PRIMARY KEY (guild_id, race_id, race_date, team_name)
+);
+
+CREATE TABLE IF NOT EXISTS completions (
+    guild_id INTEGER NOT NULL,
+    race_id TEXT NOT NULL,
+    race_date TEXT NOT NULL,
+    team_name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (guild_id, race_id, race_date, team_name, position)
+);
+
+CREATE TABLE IF NOT EXISTS processed_instances (
+    guild_id INTEGER NOT NULL,
+    race_id TEXT NOT NULL,
+    race_date TEXT NOT NULL,
+    team_name TEXT NOT NULL,
+    instance_id TEXT NOT NULL,
+    reason TEXT,
+    roster TEXT,
+    PRIMARY KEY (guild_id, race_id, race_date, team_name, instance_id)
+);
+
+CREATE TABLE IF NOT EXISTS checkpoints (
+    guild_id INTEGER NOT NULL,
+    race_id TEXT NOT NULL,
+    race_date TEXT NOT NULL,
+    team_name TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (guild_id, race_id, race_date, team_name)
+);
+"""
+
+RACE_FIELDS = ('dungeon_name', 'dungeon_hash', 'start_date', 'end_date', 'timezone', 'race_type')
+TEAM_FIELDS = ('race_id', 'captain', 'captain_id', 'text_channel_id', 'voice_channel_id', 'message_id')
+
+_store = None
+
+def get_store():
+    """Shared (awaitable) state store - opened, and migrated from the JSON files, on first use"""
+    global _store
+    if _store is None:
+        _store = AsyncStateStore(StateStore())
+    return _store
+
+def race_date(race_data):
+    """A race's results are kept per race name and end date (a name can be reused for a later race)"""
+    return datetime.fromisoformat(race_data['end_date']).strftime('%Y%m%d')
+
+class StateStore:
+    """
+    Races, teams and race results for every guild in one SQLite database (WAL mode)
+    Reads and writes use the same dict shapes as the old RaceEvents/, Teams/ and Results/
+    JSON files, but each write is a small transaction on just the rows it changes.
+    """
+    def __init__(self, path=STATE_DB_PATH):
+        self.path = path
+        self.lock = threading.RLock()
+        
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=10)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('PRAGMA foreign_keys=ON')
+        
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version < SCHEMA_VERSION:
+            # (statement by statement - executescript would commit outside the transaction)
+            with self.transaction() as db:
+                for statement in SCHEMA.split(';'):
+                    if statement.strip():
+                        db.execute(statement)
+                if version == 0:
+                    self._migrate_json(db)
+                db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    
+    @contextmanager
+    def transaction(self):
+        """One write transaction (rolled back if the block raises)"""
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.db
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+    
+    def _query(self, sql, params=()):
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+    
+    def close(self):
+        with self.lock:
+            self.db.close()
+    
+    # ---- Races ----
+    
+    def load_events(self, guild_id):
+        """{race_id: race_data} for a guild"""
+        rows = self._query(
+            f'SELECT race_id, {", ".join(RACE_FIELDS)} FROM races WHERE guild_id = ? ORDER BY rowid',
+            (guild_id,)
+        )
+        return {row[0]: dict(zip(RACE_FIELDS, row[1:])) for row in rows}
+    
+    def load_all_events(self):
+        """{guild_id: {race_id: race_data}} for every guild"""
+        events = {}
+        rows = self._query(f'SELECT guild_id, race_id, {", ".join(RACE_FIELDS)} FROM races ORDER BY rowid')
+        for row in rows:
+            events.setdefault(row[0], {})[row[1]] = dict(zip(RACE_FIELDS, row[2:]))
+        return events
+    
+    def put_race(self, guild_id, race_id, race_data):
+        with self.transaction() as db:
+            self._put_race(db, guild_id, race_id, race_data)
+    
+    def _put_race(self, db, guild_id, race_id, race_data):
+        db.execute(
+            f'INSERT INTO races (guild_id, race_id, {", ".join(RACE_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+            f'ON CONFLICT (guild_id, race_id) DO UPDATE SET '
+            + ', '.join(f'{field} = excluded.{field}' for field in RACE_FIELDS),
+            (guild_id, race_id, *[race_data.get(field) for field in RACE_FIELDS])
+        )
+    
+    def delete_race(self, guild_id, race_id):
+        """Remove a race (its results are kept)"""
+        with self.transaction() as db:
+            db.execute('DELETE FROM races WHERE guild_id = ? AND race_id = ?', (guild_id, race_id))
+    
+    # ---- Teams ----
+    
+    def load_teams(self, guild_id, race_id=None):
+        """{team_name: team_data} for a guild (or just one race's teams)"""
+        with self.lock:
+            if race_id is None:
+                rows = self.db.execute(
+                    f'SELECT team_name, {", ".join(TEAM_FIELDS)} FROM teams WHERE guild_id = ? ORDER BY rowid',
+                    (guild_id,)
+                ).fetchall()
+                member_rows = self.db.execute(
+                    'SELECT team_name, member FROM members WHERE guild_id = ? ORDER BY team_name, position',
+                    (guild_id,)
+                ).fetchall()
+            else:
+                rows = self.db.execute(
+                    f'SELECT team_name, {", ".join(TEAM_FIELDS)} FROM teams '
+                    f'WHERE guild_id = ? AND race_id = ? ORDER BY rowid',
+                    (guild_id, race_id)
+                ).fetchall()
+                member_rows = self.db.execute(
+                    'SELECT members.team_name, member FROM members JOIN teams USING (guild_id, team_name) '
+                    'WHERE guild_id = ? AND race_id = ? ORDER BY members.team_name, position',
+                    (guild_id, race_id)
+                ).fetchall()
+        
+        teams = {row[0]: {**dict(zip(TEAM_FIELDS, row[1:])), 'members': []} for row in rows}
+        for team_name, member in member_rows:
+            if team_name in teams:
+                teams[team_name]['members'].append(member)
+        return teams
+    
+    def get_team(self, guild_id, team_name):
+        """One team's data, or None"""
+        with self.lock:
+            row = self.db.execute(
+                f'SELECT {", ".join(TEAM_FIELDS)} FROM teams WHERE guild_id = ? AND team_name = ?',
+                (guild_id, team_name)
+            ).fetchone()
+            if row is None:
+                return None
+            members = self.db.execute(
+                'SELECT member FROM members WHERE guild_id = ? AND team_name = ? ORDER BY position',
+                (guild_id, team_name)
+            ).fetchall()
+        
+        return {**dict(zip(TEAM_FIELDS, row)), 'members': [member for (member,) in members]}
+    
+    def _put_team(self, db, guild_id, team_name, team_data):
+        db.execute(
+            f'INSERT INTO teams (guild_id, team_name, {", ".join(TEAM_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+            f'ON CONFLICT (guild_id, team_name) DO UPDATE SET '
+            + ', '.join(f'{field} = excluded.{field}' for field in TEAM_FIELDS),
+            (guild_id, team_name, *[team_data.get(field) for field in TEAM_FIELDS])
+        )
+        db.execute('DELETE FROM members WHERE guild_id = ? AND team_name = ?', (guild_id, team_name))
+        db.executemany(
+            'INSERT INTO members (guild_id, team_name, position, member) VALUES (?, ?, ?, ?)',
+            [(guild_id, team_name, position, member) for position, member in enumerate(team_data.get('members', []))]
+        )
+    
+    def apply_team_changes(self, guild_id, changes):
+        """Save several teams at once ({team_name: team_data, or None to delete it}) in one transaction"""
+        with self.transaction() as db:
+            for team_name, team_data in changes.items():
+                if team_data is None:
+                    db.execute('DELETE FROM teams WHERE guild_id = ? AND team_name = ?', (guild_id, team_name))
+                else:
+                    self._put_team(db, guild_id, team_name, team_data)
+    
+    # ---- Results ----
+    
+    def load_results(self, guild_id, race_id, race_data):
+        """{team_name: result} for a race ({} if it has none yet)"""
+        key = (guild_id, race_id, race_date(race_data))
+        where = 'WHERE guild_id = ? AND race_id = ? AND race_date = ?'
+        
+        with self.lock:
+            rows = self.db.execute(
+                f'SELECT team_name, time, completions, status, team_members FROM results {where} ORDER BY rowid', key
+            ).fetchall()
+            times = self.db.execute(
+                f'SELECT team_name, seconds FROM completions {where} ORDER BY team_name, position', key
+            ).fetchall()
+            instances = self.db.execute(
+                f'SELECT team_name, instance_id, reason, roster FROM processed_instances {where} ORDER BY rowid', key
+            ).fetchall()
+        
+        results = {}
+        for team_name, result_time, completions, status, team_members in rows:
+            results[team_name] = {
+                'time': result_time,
+                'completions': completions,
+                'all_times': [],
+                'processed_instances': [],
+                'rejected_instances': {},
+                'team_members': json.loads(team_members) if team_members else []
+            }
+            if status:
+                results[team_name]['status'] = status
+        
+        for team_name, seconds in times:
+            if team_name in results:
+                results[team_name]['all_times'].append(seconds)
+        
+        # Processed runs are either counted (no reason) or rejected for a roster
+        for team_name, instance_id, reason, roster in instances:
+            if team_name not in results:
+                continue
+            if reason is None:
+                results[team_name]['processed_instances'].append(instance_id)
+            else:
+                results[team_name]['rejected_instances'][instance_id] = {'reason': reason, 'roster': roster}
+        
+        return results
+    
+    def put_results(self, guild_id, race_id, race_data, results):
+        """Save the given teams' results for a race (other teams' rows are left alone)"""
+        with self.transaction() as db:
+            for team_name, result in results.items():
+                self._put_result(db, (guild_id, race_id, race_date(race_data), team_name), result)
+    
+    def _put_result(self, db, key, result):
+        db.execute(
+            'INSERT INTO results (guild_id, race_id, race_date, team_name, time, completions, status, team_members) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (guild_id, race_id, race_date, team_name) DO UPDATE SET '
+            'time = excluded.time, completions = excluded.completions, '
+            'status = excluded.status, team_members = excluded.team_members',
+            (*key, result.get('time'), result.get('completions', 0), result.get('status'),
+             json.dumps(result.get('team_members', [])))
+        )
+        
+        where = 'WHERE guild_id = ? AND race_id = ? AND race_date = ? AND team_name = ?'
+        db.execute(f'DELETE FROM completions {where}', key)
+        db.execute(f'DELETE FROM processed_instances {where}', key)
+        
+        db.executemany(
+            'INSERT INTO completions (guild_id, race_id, race_date, team_name, position, seconds) VALUES (?, ?, ?, ?, ?, ?)',
+            [(*key, position, seconds) for position, seconds in enumerate(result.get('all_times', []))]
+        )
+        db.executemany(
+            'INSERT OR IGNORE INTO processed_instances (guild_id, race_id, race_date, team_name, instance_id, reason, roster) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(*key, str(instance_id), None, None) for instance_id in result.get('processed_instances', [])]
+            + [
+                (*key, str(instance_id), rejection.get('reason') or 'Rejected', rejection.get('roster'))
+                for instance_id, rejection in result.get('rejected_instances', {}).items()
+            ]
+        )
+    
+    # ---- Check checkpoints (see utils/checkpoint.py) ----
+    
+    def load_checkpoint(self, guild_id, race_id, race_data):
+        rows = self._query(
+            'SELECT team_name, data FROM checkpoints WHERE guild_id = ? AND race_id = ? AND race_date = ?',
+            (guild_id, race_id, race_date(race_data))
+        )
+        return {team_name: json.loads(data) for team_name, data in rows}
+    
+    def put_checkpoint(self, guild_id, race_id, race_data, team_name, entry):
+        with self.transaction() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO checkpoints (guild_id, race_id, race_date, team_name, data) VALUES (?, ?, ?, ?, ?)',
+                (guild_id, race_id, race_date(race_data), team_name, json.dumps(entry))
+            )
+    
+    def clear_checkpoint(self, guild_id, race_id, race_data):
+        with self.transaction() as db:
+            db.execute(
+                'DELETE FROM checkpoints WHERE guild_id = ? AND race_id = ? AND race_date = ?',
+                (guild_id, race_id, race_date(race_data))
+            )
+    
+    # ---- One-shot migration ----
+    
+    def _migrate_json(self, db, root='.'):
+        """Import the old RaceEvents/, Teams/ and Results/ JSON files into a new database"""
+        races = teams = results = 0
+        
+        for events_file in glob.glob(os.path.join(root, 'RaceEvents', '*.json')):
+            guild_id = self._guild_from_path(events_file)
+            if guild_id is None:
+                continue
+            for race_id, race_data in self._read_json(events_file).items():
+                self._put_race(db, guild_id, race_id, race_data)
+                races += 1
+        
+        for teams_file in glob.glob(os.path.join(root, 'Teams', '*.json')):
+            guild_id = self._guild_from_path(teams_file)
+            if guild_id is None:
+                continue
+            for team_name, team_data in self._read_json(teams_file).items():
+                self._put_team(db, guild_id, team_name, team_data)
+                teams += 1
+        
+        for results_file in glob.glob(os.path.join(root, 'Results', '*', '*.json')):
+            if results_file.endswith('.checkpoint.json'):
+                continue
+            try:
+                guild_id = int(os.path.basename(os.path.dirname(results_file)))
+                race_id, date = os.path.splitext(os.path.basename(results_file))[0].rsplit('_', 1)
+            except ValueError:
+                print(f"⚠️  Skipping unrecognised results file {results_file}")
+                continue
+            for team_name, result in self._read_json(results_file).items():
+                self._put_result(db, (guild_id, race_id, date, team_name), result)
+            results += 1
+        
+        if races or teams or results:
+            print(f"📦 Migrated {races} race(s), {teams} team(s) and {results} results file(s) "
+                  f"from JSON into {self.path} (the old files are no longer used)")
+    
+    @staticmethod
+    def _guild_from_path(path):
+        try:
+            return int(os.path.splitext(os.path.basename(path))[0])
+        except ValueError:
+            print(f"⚠️  Skipping unrecognised file {path}")
+            return None
+    
+    @staticmethod
+    def _read_json(path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f) or {}
+        except Exception as e:
+            print(f"⚠️  Could not migrate {path}: {e}")
+            return {}
+
+class AsyncStateStore:
+    """
+    Awaitable front for a StateStore
+    Every query and write (and the JSON encoding of results) runs on the store's own thread,
+    so a slow disk or a big results write never stalls the gateway heartbeat or delays
+    interaction acknowledgements. One thread keeps writes in the order they were made.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='state-store')
+    
+    async def _run(self, method, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, method, *args)
+    
+    async def load_events(self, guild_id):
+        return await self._run(self.store.load_events, guild_id)
+    
+    async def load_all_events(self):
+        return await self._run(self.store.load_all_events)
+    
+    async def put_race(self, guild_id, race_id, race_data):
+        await self._run(self.store.put_race, guild_id, race_id, race_data)
+    
+    async def delete_race(self, guild_id, race_id):
+        await self._run(self.store.delete_race, guild_id, race_id)
+    
+    async def load_teams(self, guild_id, race_id=None):
+        return await self._run(self.store.load_teams, guild_id, race_id)
+    
+    async def get_team(self, guild_id, team_name):
+        return await self._run(self.store.get_team, guild_id, team_name)
+    
+    async def apply_team_changes(self, guild_id, changes):
+        await self._run(self.store.apply_team_changes, guild_id, changes)
+    
+    async def load_results(self, guild_id, race_id, race_data):
+        return await self._run(self.store.load_results, guild_id, race_id, race_data)
+    
+    async def put_results(self, guild_id, race_id, race_data, results):
+        await self._run(self.store.put_results, guild_id, race_id, race_data, results)
+    
+    async def load_checkpoint(self, guild_id, race_id, race_data):
+        return await self._run(self.store.load_checkpoint, guild_id, race_id, race_data)
+    
+    async def put_checkpoint(self, guild_id, race_id, race_data, team_name, entry):
+        await self._run(self.store.put_checkpoint, guild_id, race_id, race_data, team_name, entry)
+    
+    async def clear_checkpoint(self, guild_id, race_id, race_data):
+        await self._run(self.store.clear_checkpoint, guild_id, race_id, race_data)
+    
+    async def close(self):
+        """Finish queued writes and close the database"""
+        await self._run(self.store.close)
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,262 @@
+# utils/team_cache.py
+import asyncio
+import os
+from utils.state_store import get_store
+
+# Seconds to hold team changes before writing them, so a burst of button clicks is one write
+TEAM_FLUSH_DELAY_SECONDS = float(os.getenv('TEAM_FLUSH_DELAY_SECONDS', '1'))
+
+# Most players a team can have
+MAX_TEAM_MEMBERS = 3
+
+_team_cache = None
+
+def get_team_cache():
+    """Shared in-memory team model (each guild is loaded from the state store on first use)"""
+    global _team_cache
+    if _team_cache is None:
+        _team_cache = TeamCache(get_store())
+    return _team_cache
+
+class TeamError(Exception):
+    """A team change that was refused (the message is shown to the user)"""
+
+def _player_key(member):
+    # Bungie names are case-insensitive
+    return member.strip().lower()
+
+def _copy(team_data):
+    # Callers get their own copy, so editing it never changes the cache behind put_team's back
+    return {**team_data, 'members': list(team_data.get('members', []))}
+
+class TeamCache:
+    """
+    Every guild's teams kept in memory, written through to the state store
+    Reads never touch the database (`await load()` brings a guild in first). Changes are applied in memory right away and a guild's
+    pending changes are flushed in one transaction shortly after, so a burst of joins/leaves
+    costs one write. The bot process is the only writer of teams (monitor workers just read
+    them from the store).
+    
+    create_team/update_team/rename_team check and apply a change in one step without awaiting,
+    so concurrent handlers for a guild are serialized by the event loop: each commits its change
+    before going on to slow Discord calls, and none of them can overwrite another's.
+    
+    Each guild also keeps reverse indexes - player -> team per race and captain's user ID ->
+    teams - updated on every change, so membership and captain lookups don't scan the teams.
+    """
+    def __init__(self, store, flush_delay=TEAM_FLUSH_DELAY_SECONDS):
+        self.store = store
+        self.flush_delay = flush_delay
+        self.guilds = {}  # guild_id -> {team_name: team_data}
+        self.members = {}  # guild_id -> {player key: {race_id: team_name}}
+        self.captains = {}  # guild_id -> {captain's user ID: {team_name, ...}}
+        self.pending = {}  # guild_id -> names of teams changed since the last flush
+        self._timers = {}  # guild_id -> scheduled flush
+        self._flushing = set()  # flushes writing right now
+    
+    async def load(self, guild_id):
+        """Load a guild's teams from the store (off the event loop) unless they're already in memory"""
+        if guild_id not in self.guilds:
+            teams = await self.store.load_teams(guild_id)
+            if guild_id not in self.guilds:  # another handler may have loaded it while we waited
+                self._loaded(guild_id, teams)
+    
+    def _loaded(self, guild_id, teams):
+        self.guilds[guild_id] = teams
+        self.members[guild_id] = {}
+        self.captains[guild_id] = {}
+        for team_name, team_data in teams.items():
+            self._index(guild_id, team_name, team_data)
+    
+    def _teams(self, guild_id):
+        if guild_id not in self.guilds:
+            # Callers should `await load()` first - this blocking read is only a fallback
+            self._loaded(guild_id, self.store.store.load_teams(guild_id))
+        return self.guilds[guild_id]
+    
+    def _index(self, guild_id, team_name, team_data):
+        for member in team_data.get('members', []):
+            self.members[guild_id].setdefault(_player_key(member), {})[team_data.get('race_id')] = team_name
+        if team_data.get('captain_id') is not None:
+            self.captains[guild_id].setdefault(team_data['captain_id'], set()).add(team_name)
+    
+    def _unindex(self, guild_id, team_name, team_data):
+        members = self.members[guild_id]
+        for member in team_data.get('members', []):
+            races = members.get(_player_key(member), {})
+            if races.get(team_data.get('race_id')) == team_name:
+                del races[team_data.get('race_id')]
+                if not races:
+                    del members[_player_key(member)]
+        
+        captained = self.captains[guild_id].get(team_data.get('captain_id'))
+        if captained is not None:
+            captained.discard(team_name)
+            if not captained:
+                del self.captains[guild_id][team_data['captain_id']]
+    
+    def load_teams(self, guild_id, race_id=None):
+        """{team_name: team_data} for a guild (or just one race's teams)"""
+        return {
+            team_name: _copy(team_data)
+            for team_name, team_data in self._teams(guild_id).items()
+            if race_id is None or team_data.get('race_id') == race_id
+        }
+    
+    def get_team(self, guild_id, team_name):
+        """One team's data, or None"""
+        team_data = self._teams(guild_id).get(team_name)
+        return _copy(team_data) if team_data else None
+    
+    def put_team(self, guild_id, team_name, team_data):
+        teams = self._teams(guild_id)
+        if team_name in teams:
+            self._unindex(guild_id, team_name, teams[team_name])
+        teams[team_name] = _copy(team_data)
+        self._index(guild_id, team_name, teams[team_name])
+        self._changed(guild_id, team_name)
+    
+    def find_member_team(self, guild_id, race_id, member):
+        """Name of the team a player is on for a race (any race if race_id is None), or None"""
+        self._teams(guild_id)
+        races = self.members[guild_id].get(_player_key(member), {})
+        if race_id is None:
+            return next(iter(races.values()), None)
+        return races.get(race_id)
+    
+    def captain_teams(self, guild_id, user_id):
+        """Names of the teams a Discord user captains"""
+        self._teams(guild_id)
+        return set(self.captains[guild_id].get(user_id, ()))
+    
+    def create_team(self, guild_id, team_name, team_data):
+        """Add a new team, unless its name is taken or one of its players is already racing on another team"""
+        if team_name in self._teams(guild_id):
+            raise TeamError(f"A team named '{team_name}' already exists!")
+        
+        members = team_data.get('members', [])
+        if len(members) > MAX_TEAM_MEMBERS:
+            raise TeamError(f"Teams can have at most {MAX_TEAM_MEMBERS} players!")
+        
+        for member in members:
+            other_team_name = self.find_member_team(guild_id, team_data.get('race_id'), member)
+            if other_team_name:
+                raise TeamError(
+                    f"Error: {member} is already on team '{other_team_name}'. "
+                    "Players can only be on one team per race. Try again!"
+                )
+        
+        self.put_team(guild_id, team_name, team_data)
+    
+    def update_team(self, guild_id, team_name, change):
+        """
+        Read, change and save a team in one step
+        `change(team_data)` edits the team and returns it (or None to delete the team), or raises
+        TeamError to refuse. It must not await. Returns the team as saved (None if deleted).
+        """
+        team_data = self.get_team(guild_id, team_name)
+        if team_data is None:
+            raise TeamError("Team not found!")
+        
+        team_data = change(team_data)
+        if team_data is None:
+            self.delete_team(guild_id, team_name)
+            return None
+        
+        if len(team_data.get('members', [])) > MAX_TEAM_MEMBERS:
+            raise TeamError(f"Team is full (max {MAX_TEAM_MEMBERS} players)!")
+        
+        self.put_team(guild_id, team_name, team_data)
+        return _copy(team_data)
+    
+    def rename_team(self, guild_id, old_name, new_name):
+        teams = self._teams(guild_id)
+        if old_name not in teams:
+            raise TeamError("Team not found!")
+        if new_name == old_name:
+            return
+        if new_name in teams:
+            raise TeamError("A team with that name already exists!")
+        team_data = teams.pop(old_name)
+        self._unindex(guild_id, old_name, team_data)
+        teams[new_name] = team_data
+        self._index(guild_id, new_name, team_data)
+        self._changed(guild_id, old_name, new_name)
+    
+    def delete_team(self, guild_id, team_name):
+        team_data = self._teams(guild_id).pop(team_name, None)
+        if team_data is not None:
+            self._unindex(guild_id, team_name, team_data)
+            self._changed(guild_id, team_name)
+    
+    def delete_teams(self, guild_id, race_id=None):
+        """Remove every team of a guild (or of one race)"""
+        teams = self._teams(guild_id)
+        doomed = [
+            team_name for team_name, team_data in teams.items()
+            if race_id is None or team_data.get('race_id') == race_id
+        ]
+        for team_name in doomed:
+            self._unindex(guild_id, team_name, teams.pop(team_name))
+        if doomed:
+            self._changed(guild_id, *doomed)
+    
+    def _changed(self, guild_id, *team_names):
+        self.pending.setdefault(guild_id, set()).update(team_names)
+        self._schedule(guild_id)
+    
+    def _schedule(self, guild_id):
+        if guild_id in self._timers:
+            return  # a flush is already coming - this change rides along
+        
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # no event loop (scripts) - write now
+            team_names, changes = self._take(guild_id)
+            self.store.store.apply_team_changes(guild_id, changes)
+            return
+        
+        self._timers[guild_id] = loop.call_later(self.flush_delay, self._start_flush, guild_id)
+    
+    def _start_flush(self, guild_id):
+        task = asyncio.ensure_future(self.flush(guild_id))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+    
+    def _take(self, guild_id):
+        # Pending changes as of now - copied, since the teams keep changing while the write runs
+        timer = self._timers.pop(guild_id, None)
+        if timer:
+            timer.cancel()
+        
+        team_names = self.pending.pop(guild_id, set())
+        teams = self.guilds.get(guild_id, {})
+        changes = {
+            team_name: _copy(teams[team_name]) if team_name in teams else None
+            for team_name in team_names
+        }
+        return team_names, changes
+    
+    async def flush(self, guild_id):
+        """Write a guild's pending team changes in one transaction"""
+        team_names, changes = self._take(guild_id)
+        if not changes:
+            return
+        
+        try:
+            await self.store.apply_team_changes(guild_id, changes)
+        except Exception as e:
+            print(f"❌ Could not save teams for guild {guild_id} ({e}) - retrying")
+            self.pending.setdefault(guild_id, set()).update(team_names)
+            if guild_id not in self._timers:
+                self._timers[guild_id] = asyncio.get_running_loop().call_later(
+                    self.flush_delay * 5, self._start_flush, guild_id
+                )
+    
+    async def flush_all(self):
+        """Write everything still pending, and wait for writes already under way (on shutdown)"""
+        for guild_id in list(self.pending):
+            await self.flush(guild_id)
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
@@ -1,7 +1,6 @@
 # utils/team_manager.py
 import discord
-import json
-import os
+from utils.team_cache import get_team_cache
 
 PURPLE = 0x9B59B6
 
@@ -12,13 +11,11 @@ def setup_team_message_view(team_name, guild_id):
 
 async def reinitialize_team_messages(guild):
     """Recreate views for all team messages after bot restart"""
-    teams_file = f'./Teams/{guild.id}.json'
-    if not os.path.exists(teams_file):
+    await get_team_cache().load(guild.id)
+    teams = get_team_cache().load_teams(guild.id)
+    if not teams:
         return
     
-    with open(teams_file, 'r') as f:
-        teams = json.load(f)
-    
     teams_channel = discord.utils.get(guild.text_channels, name='teams')
     if not teams_channel:
         return
@@ -43,12 +40,8 @@ async def reinitialize_team_messages(guild):
 async def cleanup_empty_voice_channels(bot):
     """Kick players from team voice channels when they're empty (called periodically)"""
     for guild in bot.guilds:
-        teams_file = f'./Teams/{guild.id}.json'
-        if not os.path.exists(teams_file):
-            continue
-        
-        with open(teams_file, 'r') as f:
-            teams = json.load(f)
+        await get_team_cache().load(guild.id)
+        teams = get_team_cache().load_teams(guild.id)
         
         for team_name, team_data in teams.items():
             voice_channel_id = team_data.get('voice_channel_id')
@@ -61,38 +54,20 @@ async def cleanup_empty_voice_channels(bot):
                 # (Discord will automatically disconnect them when channel is deleted)
                 pass
 
-def get_team_by_member(guild_id, member_name, race_id=None):
+async def get_team_by_member(guild_id, member_name, race_id=None):
     """Find which team a member belongs to"""
-    teams_file = f'./Teams/{guild_id}.json'
-    if not os.path.exists(teams_file):
+    teams = get_team_cache()
+    await teams.load(guild_id)
+    team_name = teams.find_member_team(guild_id, race_id, member_name)
+    if not team_name:
         return None
     
-    with open(teams_file, 'r') as f:
-        teams = json.load(f)
-    
-    for team_name, team_data in teams.items():
-        if race_id and team_data.get('race_id') != race_id:
-            continue
-        
-        if member_name in team_data.get('members', []):
-            return team_name, team_data
-    
-    return None
+    return team_name, teams.get_team(guild_id, team_name)
 
-def is_team_captain(guild_id, team_name, user_id):
+async def is_team_captain(guild_id, team_name, user_id):
     """Check if a user is the captain of a team"""
-    teams_file = f'./Teams/{guild_id}.json'
-    if not os.path.exists(teams_file):
-        return False
-    
-    with open(teams_file, 'r') as f:
-        teams = json.load(f)
-    
-    team_data = teams.get(team_name)
-    if not team_data:
-        return False
-    
-    return team_data.get('captain_id') == user_id
+    await get_team_cache().load(guild_id)
+    return team_name in get_team_cache().captain_teams(guild_id, user_id)
 
 
 # ===================================
@@ -0,0 +1,35 @@
+# utils/validation_cache.py
+from utils.file_cache import JSONFileCache
+
+# Oldest verdicts are dropped past this many entries
+MAX_VALIDATIONS = 50000
+
+class ValidationCache(JSONFileCache):
+    """
+    Persistent memo of validate_completion verdicts keyed by (instanceId, roster fingerprint)
+    A PGCR never changes, so the verdict for the same run and the same roster never changes either.
+    """
+    label = 'validation cache'
+    
+    def __init__(self, path='./Cache/validations.json', max_entries=MAX_VALIDATIONS):
+        super().__init__(path)
+        self.max_entries = max_entries
+    
+    @staticmethod
+    def _key(instance_id, roster):
+        return f'{instance_id}:{roster}'
+    
+    def get(self, instance_id, roster):
+        """Return (is_valid, reason) if this run was already checked against this roster"""
+        verdict = self.entries.get(self._key(instance_id, roster))
+        if verdict is None:
+            return None
+        return verdict[0], verdict[1]
+    
+    def put(self, instance_id, roster, is_valid, reason):
+        self.entries[self._key(instance_id, roster)] = [is_valid, reason]
+        self.dirty = True
+        
+        # dicts keep insertion order, so the first keys are the oldest
+        while len(self.entries) > self.max_entries:
+            del self.entries[next(iter(self.entries))]